@@ -1,94 +1,350 @@
+import json
 import logging
 import os
-from pathlib import Path
+import queue
+import threading
+import time
+import uuid
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
 
-from src.settings import UPLOAD_DIR
-from src.transcribe import transcribe_file, transcribe_file_segment
+from src.audio_util import to_ms
+from src.jobs import JobQueue, QueueFullError
+from src.metrics import metrics, timed, start_timings, collect_timings, total_timings, server_timing
+from src.model_registry import DEFAULT_DEVICE, registry
+from src.settings import UPLOAD_DIR, WARMUP_MODELS, TIMING_HEADERS, DB_BACKEND, BULK_MAX_ITEMS
+from src.storage import SEARCH_LIMIT, SEGMENTS_MAX_LIMIT, VersionConflict, load_backend
+from src.transcribe import transcribe_cached, stream_transcription, format_result, format_segment
 from src.youtube_util import download_audio
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# db
+# set by create_app
 DB_ENABLED = False
-try:
-    import src.db as db
-
-    DB_ENABLED = True
-    logger.info("MongoDB enabled")
-except Exception as e:
-    db = None
-    logger.error("MongoDB disabled")
-    logger.error(e)
+db = None
+job_queue: JobQueue = None
+_setup_lock = threading.Lock()
 
 app = Flask(__name__)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_DIR
 
 
+def create_app() -> Flask:
+    """
+    connect the db, start the job queue, warm up models. done once, in the serving process only
+    (at the latest before its first request): transcription worker processes (spawn) import this module again,
+    and only need the model
+    """
+    global DB_ENABLED, db, job_queue
+    with _setup_lock:
+        if job_queue is not None:
+            return app
+
+        try:
+            db = load_backend()
+
+            DB_ENABLED = True
+            logger.info(f"DB enabled ({DB_BACKEND})")
+        except Exception as e:
+            db = None
+            logger.error(f"DB disabled ({DB_BACKEND})")
+            logger.error(e)
+
+        registry.warm_up(WARMUP_MODELS)
+
+        job_queue = JobQueue()  # after the rest: set means set up
+        metrics.gauge_fn('jobs', lambda: {(('status', status),): n for status, n in job_queue.counts().items()})
+        metrics.describe('jobs', "jobs per status (queued: queue depth)")
+    return app
+
+
+@app.before_request
+def ensure_setup():
+    """`flask --app src.app run`, `gunicorn src.app:app`: the app is set up before its first request"""
+    if job_queue is None:
+        create_app()
+
+
+@app.before_request
+def start_request_timing():
+    g.start_time = time.perf_counter()
+    g.timings = start_timings()
+
+
+@app.after_request
+def record_request_timing(response):
+    elapsed = time.perf_counter() - g.start_time
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('request_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('requests_total', endpoint=endpoint, status=response.status_code)
+
+    if TIMING_HEADERS:
+        # streamed responses: only the stages before the body starts
+        g.timings.append(('total', elapsed))
+        response.headers['Server-Timing'] = server_timing(g.timings)
+    return response
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
-@app.route('/transcribe', methods=['POST'])
-def transcribe():
+def parse_transcribe_request() -> tuple[dict | None, tuple | None]:
+    """form -> (params, None), or (None, error response). uploaded files are saved"""
     source_type = request.form['source_type']
     show_timestamps = request.form.get('show_timestamps') == 'on'
     start_time = request.form.get('start_time')
     end_time = request.form.get('end_time')
     logger.info(f"{source_type}, show_timestamps: {show_timestamps}, start_time: {start_time}, end_time: {end_time}")
 
-    meta = None
-    upload_filepath = None
+    params = {'upload_filepath': None, 'youtube_url': None, 'meta': None,
+              'start_time': start_time, 'end_time': end_time, 'show_timestamps': show_timestamps}
+
+    if source_type == 'file':
+        if 'audio_file' not in request.files:
+            return None, (jsonify({'error': 'No audio_file'}), 400)
+
+        file = request.files['audio_file']
+
+        if file.filename == '':
+            return None, (jsonify({'error': 'No selected file'}), 400)
+
+        filename = secure_filename(file.filename)
+        # unique name, concurrent jobs may upload files with the same name
+        upload_filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex[:8]}_{filename}")
+        with timed('upload_save'):
+            file.save(upload_filepath)
+        params['upload_filepath'] = upload_filepath
+        params['meta'] = {'title': filename, 'src_type': 'file'}
+
+    elif source_type == 'youtube':
+        youtube_url = request.form.get('youtube_url')
+        if not youtube_url:
+            return None, (jsonify({'error': 'No YouTube URL provided'}), 400)
+        if not youtube_url.startswith('https://www.youtube.com/'):
+            return None, (jsonify({'error': 'Not YouTube URL'}), 400)
+        params['youtube_url'] = youtube_url
+    else:
+        logger.error(f"Invalid source_type: {source_type}")
+        return None, (jsonify({'error': 'Invalid input'}), 400)
+
+    return params, None
+
+
+def prepare_audio(params: dict) -> dict:
+    """downloads youtube audio (only the requested section, already 16kHz mono). updates params"""
+    if params['youtube_url']:
+        upload_filepath, meta = download_audio(params['youtube_url'], params['start_time'], params['end_time'],
+                                               whisper_ready=True)
+        meta['src_type'] = 'youtube'
+        logger.info(f"downloaded audio: '{upload_filepath}'")
+        params.update(upload_filepath=upload_filepath, meta=meta, start_time=None, end_time=None)
+    return params
+
+
+def remove_upload(params: dict):
+    upload_filepath = params['upload_filepath']
+    if upload_filepath and os.path.exists(upload_filepath):
+        os.remove(upload_filepath)
+
+
+def transcribe_job(job, params: dict):
+    with collect_timings() as timings:
+        try:
+            if params['youtube_url']:
+                job.update(stage='downloading')
+            prepare_audio(params)
+
+            job.update(stage='waiting for device')
+            with job_queue.device_slot(DEFAULT_DEVICE):
+                job.update(stage='transcribing')
+                result = transcribe_cached(params['upload_filepath'], params['start_time'], params['end_time'],
+                                           progress=lambda fraction: job.update(progress=fraction))
+        finally:
+            # rm uploaded file
+            remove_upload(params)
+
+    return {'message': 'Transcription completed', 'transcript': format_result(result, params['show_timestamps']),
+            'meta': params['meta'], 'timings': {k: round(v, 3) for k, v in total_timings(timings).items()}}
+
+
+@app.route('/transcribe', methods=['POST'])
+def transcribe():
+    """enqueues a transcription job, returns its id (poll /jobs/<job_id>)"""
+    params = None
     try:
-        if source_type == 'file':
-            if 'audio_file' not in request.files:
-                return jsonify({'error': 'No audio_file'}), 400
-
-            file = request.files['audio_file']
-
-            if file.filename == '':
-                return jsonify({'error': 'No selected file'}), 400
-
-            if file:
-                filename = secure_filename(file.filename)
-                upload_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(upload_filepath)
-                meta = {'title': filename, 'src_type': 'file'}
-
-        elif source_type == 'youtube':
-            youtube_url = request.form.get('youtube_url')
-            if not youtube_url:
-                return jsonify({'error': 'No YouTube URL provided'}), 400
-            if not youtube_url.startswith('https://www.youtube.com/'):
-                return jsonify({'error': 'Not YouTube URL'}), 400
-
-            upload_filepath, meta = download_audio(youtube_url)
-            meta['src_type'] = 'youtube'
-            logger.info(f"downloaded audio: '{upload_filepath}'")
-        else:
-            logger.error(f"Invalid source_type: {source_type}")
-            return jsonify({'error': 'Invalid input'}), 400
+        params, error = parse_transcribe_request()
+        if error:
+            return error
+
+        job = job_queue.submit(transcribe_job, params)
 
+    except QueueFullError as e:
+        remove_upload(params)
+        metrics.inc('jobs_rejected_total')
+        logger.error(e)
+        return jsonify({'error': 'Server busy, try again later'}), 503
     except Exception as e:
         logger.error(e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-    if start_time or end_time:
-        result_file = transcribe_file_segment(upload_filepath, start_time, end_time, show_timestamps=show_timestamps)
-    else:
-        result_file = transcribe_file(upload_filepath, show_timestamps=show_timestamps)
-
-    # rm uploaded file
-    os.remove(upload_filepath)
+    return jsonify({'message': 'Transcription queued', 'job_id': job.id}), 202
+
+
+def stream_job(job, params: dict, events: queue.Queue):
+    """transcribe_job, also putting events on `events` as it goes (None: no more events)"""
+    show_timestamps = params['show_timestamps']
+    with collect_timings() as timings:
+        try:
+            if params['youtube_url']:
+                job.update(stage='downloading')
+                events.put({'type': 'status', 'message': 'Downloading...'})
+            prepare_audio(params)
+            events.put({'type': 'meta', 'meta': params['meta']})
+
+            job.update(stage='waiting for device')
+            events.put({'type': 'status', 'message': 'Waiting for device...'})
+            with job_queue.device_slot(DEFAULT_DEVICE):
+                job.update(stage='transcribing')
+                events.put({'type': 'status', 'message': 'Transcribing...'})
+                segments = []
+                for segment in stream_transcription(params['upload_filepath'], params['start_time'],
+                                                    params['end_time'],
+                                                    progress=lambda fraction: job.update(progress=fraction)):
+                    line = format_segment(segment, show_timestamps)
+                    if show_timestamps and segments:
+                        line = f"\n{line}"
+                    segments.append(segment)
+                    events.put({'type': 'segment', 'start': segment['start'], 'end': segment['end'],
+                                'text': segment['text'], 'line': line})
+
+            result = {'text': ''.join(segment['text'] for segment in segments), 'segments': segments}
+            job_timings = {k: round(v, 3) for k, v in total_timings(timings).items()}
+            events.put({'type': 'done', 'message': 'Transcription completed', 'timings': job_timings})
+        except Exception as e:
+            events.put({'type': 'error', 'error': str(e)})
+            raise
+        finally:
+            events.put(None)
+            remove_upload(params)
+
+    return {'message': 'Transcription completed', 'transcript': format_result(result, show_timestamps),
+            'meta': params['meta'], 'timings': job_timings}
+
+
+@app.route('/transcribe/stream', methods=['POST'])
+def transcribe_stream():
+    """
+    same form as /transcribe, queued the same way (503 if the queue is full). streams ndjson events
+    as the job transcribes: {'type': 'meta' | 'status' | 'segment' | 'done' | 'error', ...}
+    """
+    try:
+        params, error = parse_transcribe_request()
+        if error:
+            return error
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        return jsonify({'error': str(e)}), 500
 
-    return jsonify(
-        {'message': 'Transcription completed', 'output_file': result_file, 'transcript': Path(result_file).read_text(),
-         'meta': meta})
+    events = queue.Queue()
+    try:
+        job = job_queue.submit(stream_job, params, events)
+    except QueueFullError as e:
+        remove_upload(params)
+        metrics.inc('jobs_rejected_total')
+        logger.error(e)
+        return jsonify({'error': 'Server busy, try again later'}), 503
+
+    def generate():
+        yield json.dumps({'type': 'status', 'message': 'Queued...', 'job_id': job.id}) + '\n'
+        while (item := events.get()) is not None:
+            yield json.dumps(item) + '\n'
+
+    # the job runs to the end even if the client disconnects (result in /jobs/<job_id>, and cached)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """status and progress. includes the result when done"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict(with_result=job.status == 'done'))
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == 'error':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'error': f'Job {job.status}', 'status': job.status}), 409
+    return jsonify(job.result)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def parse_segments(segments) -> list[dict] | None:
+    """request segments -> [{'start', 'end', 'text', 'speaker'}], ValueError if malformed"""
+    if segments is None:
+        return None
+    if not isinstance(segments, list):
+        raise ValueError("segments: expecting a list")
+
+    parsed = []
+    for segment in segments:
+        try:
+            start, end, text = float(segment['start']), float(segment['end']), str(segment['text'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"invalid segment: {segment}")
+        if end < start:
+            raise ValueError(f"segment end < start: {segment}")
+        parsed.append({'start': start, 'end': end, 'text': text, 'speaker': segment.get('speaker')})
+    return parsed
+
+
+def parse_time_arg(name: str) -> float | None:
+    """query arg in seconds, or HH:MM:SS / MM:SS"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    if ':' in value:
+        return to_ms(value) / 1000
+    return float(value)
+
+
+def etag(transcript_id: str, version: int) -> str:
+    return f"{transcript_id}-{version}"
+
+
+def if_match_version(transcript_id: str) -> tuple[int | None, tuple | None]:
+    """expected version from If-Match -> (version or None if no precondition, None), or (None, error response)"""
+    if not request.if_match or request.if_match.star_tag:
+        return None, None
+
+    for tag in request.if_match.as_set():
+        tag_id, _, version = tag.rpartition('-')
+        if tag_id == transcript_id and version.isdigit():
+            return int(version), None
+    return None, (jsonify({'error': 'If-Match: not an ETag of this transcript'}), 412)
+
+
+def versioned_response(body: dict, transcript_id: str, version: int, status=200):
+    response = jsonify(body)
+    response.status_code = status
+    response.set_etag(etag(transcript_id, version))
+    return response
 
 
 @app.route('/transcripts', methods=['POST'])
@@ -110,29 +366,111 @@ def save_transcript():
         return jsonify({'error': 'No transcript'}), 400
 
     try:
-        transcript_id = db.save_transcript(doc)
+        segments = parse_segments(data.get('segments'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        transcript_id = db.save_transcript(doc, segments)
         logger.info(f"Saved transcript: {transcript_id}")
-        return jsonify({'message': 'Transcript saved', 'id': transcript_id})
+        return versioned_response({'message': 'Transcript saved', 'id': transcript_id, 'version': 1}, transcript_id, 1)
     except Exception as e:
         logger.error(e, exc_info=True)
         return jsonify({'error': 'Failed to save transcript'}), 500
 
 
+@app.route('/transcripts/bulk', methods=['POST'])
+def save_transcripts_bulk():
+    """
+    {'transcripts': [{title, content, src_type, channel, source_id, segments}, ...], 'ordered': false}.
+    items already stored (same source_id and content) are not written again.
+    returns per item results: {'index', 'status': 'inserted' | 'exists' | 'invalid' | 'error' | 'skipped', 'id', 'error'}
+    """
+    if not DB_ENABLED:
+        return jsonify({'error': 'DB not enabled'}), 400
+
+    data = request.json or {}
+    items = data.get('transcripts')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No transcripts'}), 400
+    if len(items) > BULK_MAX_ITEMS:
+        return jsonify({'error': f'Too many transcripts ({len(items)} > {BULK_MAX_ITEMS})'}), 413
+
+    # invalid items are reported, the rest are written
+    results = [None] * len(items)
+    valid, valid_idx = [], []
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict) or not item.get('content'):
+                raise ValueError("No transcript content")
+            doc = {k: item[k] for k in ('title', 'content', 'src_type', 'channel', 'source_id') if item.get(k)}
+            segments = parse_segments(item.get('segments'))
+            if segments:
+                doc['segments'] = segments
+        except ValueError as e:
+            results[i] = {'index': i, 'status': 'invalid', 'error': str(e)}
+            continue
+        valid.append(doc)
+        valid_idx.append(i)
+
+    try:
+        for i, result in zip(valid_idx, db.save_transcripts(valid, ordered=bool(data.get('ordered')))):
+            results[i] = {**result, 'index': i}
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        return jsonify({'error': 'Failed to save transcripts'}), 500
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    logger.info(f"Bulk ingest: {counts}")
+    return jsonify({'results': results, 'counts': counts})
+
+
 @app.route('/transcripts/<transcript_id>', methods=['GET'])
 def get_transcript(transcript_id):
     if not DB_ENABLED:
         return jsonify({'error': 'DB not enabled'}), 400
 
     try:
+        # revalidation: version only, the content isn't loaded
+        if request.if_none_match:
+            version = db.get_version(transcript_id)
+            if version is not None and request.if_none_match.contains(etag(transcript_id, version)):
+                response = Response(status=304)
+                response.set_etag(etag(transcript_id, version))
+                return response
+
         res = db.get_transcript(transcript_id)
         if res:
-            return jsonify(res)
+            response = versioned_response(res, transcript_id, res['version'])
+            response.headers['Cache-Control'] = 'no-cache'  # cached, revalidated with the ETag
+            return response
         return jsonify({'error': 'Transcript not found'}), 404
     except Exception as e:
         logger.error(e, exc_info=True)
         return jsonify({'error': 'Failed to get transcript'}), 500
 
 
+@app.route('/transcripts/<transcript_id>/segments', methods=['GET'])
+def get_transcript_segments(transcript_id):
+    """segments in a time window: ?start=&end= (seconds or HH:MM:SS, both optional), without loading the transcript"""
+    if not DB_ENABLED:
+        return jsonify({'error': 'DB not enabled'}), 400
+
+    try:
+        start, end = parse_time_arg('start'), parse_time_arg('end')
+        limit = request.args.get('limit', SEGMENTS_MAX_LIMIT, type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        return jsonify({'id': transcript_id, 'segments': db.get_segments(transcript_id, start, end, limit)})
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        return jsonify({'error': 'Failed to get segments'}), 500
+
+
 @app.route('/transcripts/search', methods=['GET'])
 def search_transcripts():
     if not DB_ENABLED:
@@ -140,11 +478,14 @@ def search_transcripts():
 
     query = request.args.get('query', '')
     if not query:
-        return jsonify({'results': []})
+        return jsonify({'results': [], 'next_cursor': None})
 
     try:
-        results = db.search_transcripts(query)
-        return jsonify({'results': results})
+        limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+        results, next_cursor = db.search_transcripts(query, limit, request.args.get('cursor'))
+        return jsonify({'results': results, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(e, exc_info=True)
         return jsonify({'error': 'Failed to search transcripts'}), 500
@@ -164,15 +505,55 @@ def update_transcript(transcript_id):
     }
 
     try:
-        res = db.update_transcript(transcript_id, doc)
-        if res > 0:
-            return jsonify({'message': f'Updated {res} transcript'})
-        else:
-            return jsonify({'error': 'Transcript not found or not updated'}), 404
+        segments = parse_segments(data.get('segments'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    version, error = if_match_version(transcript_id)
+    if error:
+        return error
+
+    try:
+        new_version = db.update_transcript(transcript_id, doc, segments, version=version)
+        if new_version is None:
+            return jsonify({'error': 'Transcript not found'}), 404
+        return versioned_response({'message': 'Updated transcript', 'version': new_version}, transcript_id,
+                                  new_version)
+    except VersionConflict as e:
+        return jsonify({'error': str(e), 'version': e.current_version}), 412
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        return jsonify({'error': 'Failed to update transcript'}), 500
+
+
+@app.route('/transcripts/<transcript_id>', methods=['PATCH'])
+def patch_transcript(transcript_id):
+    """
+    {'edits': [{'start', 'end', 'text'}]}: replace content[start:end] (code points), applied by the server.
+    with If-Match: <ETag>, rejected (412) if the transcript changed since
+    """
+    if not DB_ENABLED:
+        return jsonify({'error': 'DB not enabled'}), 400
+
+    data = request.json or {}
+    version, error = if_match_version(transcript_id)
+    if error:
+        return error
+
+    try:
+        new_version = db.patch_transcript(transcript_id, data.get('edits'), version=version)
+        if new_version is None:
+            return jsonify({'error': 'Transcript not found'}), 404
+        return versioned_response({'message': 'Updated transcript', 'version': new_version}, transcript_id,
+                                  new_version)
+    except VersionConflict as e:
+        return jsonify({'error': str(e), 'version': e.current_version}), 412
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(e, exc_info=True)
         return jsonify({'error': 'Failed to update transcript'}), 500
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
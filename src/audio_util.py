@@ -1,6 +1,6 @@
 import datetime
 import logging
-import queue
+import subprocess
 import threading
 import wave
 from pathlib import Path
@@ -10,20 +10,43 @@ import sounddevice as sd
 import soundfile as sf
 from pydub import AudioSegment
 
+from src.metrics import metrics, timed
+from src.resample import StreamingResampler, resample
+from src.ring_buffer import RingBuffer
+
 SAMPLE_RATE = 44100
 REC_CHANNELS = 1
+NORMALIZE_CHUNK_FRAMES = 1 << 20  # temporaries while normalizing are at most this size
+
+# record_unlimited
+RECORD_BUFFER_SEC = 30  # capture backlog (preallocated) before blocks are dropped, e.g. while the disk stalls
+RECORD_WRITE_SEC = 1  # samples are written to the file in chunks of about this size
+OPUS_SAMPLE_RATE = 48000  # opus only supports 8/12/16/24/48 kHz
+# file extension -> soundfile (format, subtype). flac and opus are compressed, written as a stream
+RECORD_FORMATS = {
+    '.wav': ('WAV', 'PCM_16'),
+    '.flac': ('FLAC', 'PCM_16'),
+    '.ogg': ('OGG', 'VORBIS'),
+    '.opus': ('OGG', 'OPUS'),
+}
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
 
 
 class DeviceUtil:
-    devices = sd.query_devices()
+    devices = None  # queried on first use, not at import (transcription worker processes import this module)
+
+    @classmethod
+    def get_devices(cls):
+        if cls.devices is None:
+            cls.devices = sd.query_devices()
+        return cls.devices
 
     @classmethod
     def find_loopback_device(cls):
         """audio played by computer"""
-        for i, device in enumerate(cls.devices):
+        for i, device in enumerate(cls.get_devices()):
             if ('loopback' in device['name'].lower()) or ('stereo mix' in device['name'].lower()):
                 return i
 
@@ -32,7 +55,7 @@ class DeviceUtil:
     @staticmethod
     def find_output_device():
         default_devices = sd.default.device
-        for i, device in enumerate(DeviceUtil.devices):
+        for i, device in enumerate(DeviceUtil.get_devices()):
             if device['max_output_channels'] > 0 and i in default_devices:
                 return i
 
@@ -48,11 +71,20 @@ class DeviceUtil:
 
     @staticmethod
     def log_device_info(device_id):
-        device = DeviceUtil.devices[device_id]
+        device = DeviceUtil.get_devices()[device_id]
         logger.info(f"Device ID: {device_id}, Name: {device['name']}, "
                     f"Max Output Channels: {device['max_output_channels']}, Max Input Channels: {device['max_input_channels']}, "
                     f"Sample Rate: {device['default_samplerate']}")
 
+    @staticmethod
+    def supports_samplerate(device_id, samplerate, channels=1) -> bool:
+        """can the device capture natively at this rate"""
+        try:
+            sd.check_input_settings(device=device_id, samplerate=samplerate, channels=channels)
+            return True
+        except Exception:
+            return False
+
     @staticmethod
     def list_audio_devices():
         devices = sd.query_devices()
@@ -62,29 +94,52 @@ class DeviceUtil:
 
 class AudioRecorder:
     device_id = None  # initialized outside
+    recording_buffer = None  # record_unlimited's, while recording
 
     @classmethod
-    def record(cls, duration_sec, device_id=None) -> np.ndarray:
+    def record(cls, duration_sec, device_id=None, target_sr=None, out_file=None) -> np.ndarray:
+        """
+        returns normalized int16 samples at SAMPLE_RATE,
+        or, with target_sr (e.g. 16000 for whisper), normalized mono float32 at that rate
+        (captured at target_sr if the device supports it, no resampling).
+        captured into a preallocated buffer, normalized in place.
+        out_file: capture into a file mapped in memory (np.memmap, long recordings), returned as is if not resampled.
+        """
 
         if device_id is None:
             device_id = cls.device_id
 
         DeviceUtil.log_device_info(device_id)
 
-        logger.info(f"recording audio for {duration_sec} seconds...")
-        recording = sd.rec(int(duration_sec * SAMPLE_RATE), samplerate=SAMPLE_RATE,
-                           channels=REC_CHANNELS, dtype='int16', device=device_id)
+        dtype = 'float32' if target_sr else 'int16'
+        capture_rate = SAMPLE_RATE
+        if target_sr and DeviceUtil.supports_samplerate(device_id, target_sr, REC_CHANNELS):
+            capture_rate = target_sr
+
+        shape = (int(duration_sec * capture_rate), REC_CHANNELS)
+        if out_file:
+            recording = np.memmap(out_file, dtype=dtype, mode='w+', shape=shape)
+        else:
+            recording = np.empty(shape, dtype=dtype)
+
+        logger.info(f"recording audio for {duration_sec} seconds ({capture_rate} Hz)...")
+        sd.rec(out=recording, samplerate=capture_rate, device=device_id)  # channels, dtype: from out
 
         sd.wait()
         logger.info("finished recording")
 
-        # normalize
-        recording = recording / np.max(np.abs(recording))
-        # convert to int16 for wav file
-        audio_data = (recording * 32767).astype(np.int16)
+        normalize_inplace(recording)
+        if isinstance(recording, np.memmap):
+            recording.flush()
+
+        if target_sr:
+            audio_data = recording[:, 0] if REC_CHANNELS == 1 else recording  # mono: a view
+            audio_data = resample(audio_data, capture_rate, target_sr)
+            logger.info(f"recorded {len(recording)} samples ({capture_rate} Hz), {len(audio_data)} at {target_sr} Hz")
+            return audio_data
 
         logger.info(f"recorded {len(recording)} samples")
-        return audio_data
+        return recording
 
     @staticmethod
     def save_audio_data_to_file(audio_data, filename="audio.wav"):
@@ -97,39 +152,139 @@ class AudioRecorder:
         logger.info(f"audio saved as {filename}")
 
     @staticmethod
-    def record_unlimited(device_id, filename=None):
+    def record_unlimited(device_id, filename=None, max_file_sec=None, max_file_bytes=None) -> list[str]:
         """
-        record audio to file until KeyboardInterrupt
+        record audio to file until KeyboardInterrupt, in flat memory:
+        the callback copies blocks into a preallocated ring buffer (RECORD_BUFFER_SEC, full: dropped and counted),
+        the writer takes whatever is buffered in one write (about RECORD_WRITE_SEC).
+        format by extension (RECORD_FORMATS): .wav, .flac, .ogg (vorbis) or .opus.
+        max_file_sec / max_file_bytes: continue in a new file (name_001.flac, name_002.flac...) when reached.
+        returns the files written.
         https://python-sounddevice.readthedocs.io/en/0.5.0/examples.html#recording-with-arbitrary-duration
         """
         if filename is None:
-            filename = f"audio_{get_now_str()}.wav"
-
-        q = queue.Queue()
-
+            filename = f"audio_{get_now_str()}.flac"
+        file_format = RECORD_FORMATS.get(Path(filename).suffix.lower())
+        if file_format is None:
+            raise ValueError(f"unsupported format: '{filename}', expecting one of {list(RECORD_FORMATS)}")
+
+        file_rate = OPUS_SAMPLE_RATE if file_format[1] == 'OPUS' else SAMPLE_RATE
+        capture_rate = file_rate if DeviceUtil.supports_samplerate(device_id, file_rate, REC_CHANNELS) else SAMPLE_RATE
+        resampler = StreamingResampler(capture_rate, file_rate)  # in the writer, only if the device can't do file_rate
+
+        buffer = RingBuffer(capture_rate * RECORD_BUFFER_SEC)
+        AudioRecorder.recording_buffer = buffer
+        write_chunk = capture_rate * RECORD_WRITE_SEC
+        writer = RotatingSoundFile(filename, file_rate, file_format, max_file_sec, max_file_bytes)
+
+        def callback(indata, frames, time, status):
+            """called from a separate thread for each audio block. never blocks"""
+            if status:
+                print(status)
+                metrics.inc('recording_input_status_total', status=str(status).strip())
+            buffer.write(indata)
+
+        def write(n):
+            writer.write(resampler.process(buffer.peek(n)))
+            buffer.consume(n)
+
+        overflow_count = 0
         try:
-            def callback(indata, frames, time, status):
-                """called from a separate thread for each audio block."""
-                if status:
-                    print(status)
-                q.put(indata.copy())
-
-            # open file before recording
-            with sf.SoundFile(filename, mode='w', samplerate=SAMPLE_RATE, channels=REC_CHANNELS) as file:
-
-                with sd.InputStream(samplerate=SAMPLE_RATE, device=device_id, channels=REC_CHANNELS, callback=callback):
-                    logger.info(f"recording to '{filename}'.")
-                    print("press Ctrl+C to stop recording")
-                    DeviceUtil.log_device_info(device_id)
-
-                    # record
-                    while True:
-                        file.write(q.get())
+            with sd.InputStream(samplerate=capture_rate, device=device_id, channels=REC_CHANNELS, dtype='float32',
+                                callback=callback):
+                logger.info(f"recording to '{filename}' ({capture_rate} Hz capture, {file_rate} Hz file)")
+                print("press Ctrl+C to stop recording")
+                DeviceUtil.log_device_info(device_id)
+
+                while True:
+                    # wait for a chunk, then write all that's buffered (coalesced, bounded by the buffer)
+                    if buffer.peek(write_chunk, timeout=RECORD_WRITE_SEC * 2) is None:
+                        continue
+                    write(buffer.available())
+
+                    if buffer.overflow_count > overflow_count:
+                        overflow_count = buffer.overflow_count
+                        logger.warning(f"writing falling behind capture: {buffer.stats()}")
 
         except KeyboardInterrupt:
-            print(f"recording finished: '{filename}', {file.frames / SAMPLE_RATE:.1f} seconds")
-
-        return filename
+            pass
+        finally:
+            # stream stopped: the rest of the buffer, and the resampler's tail
+            if buffer.available():
+                write(buffer.available())
+            if resampler.orig_sr != resampler.target_sr:
+                writer.write(resampler.process(np.zeros(0, dtype=np.float32), last=True))
+            writer.close()
+            AudioRecorder.recording_buffer = None
+
+        print(f"recording finished: {writer.files}, {writer.total_frames / file_rate:.1f} seconds, "
+              f"dropped {buffer.overflow_samples / capture_rate:.1f} seconds")
+        return writer.files
+
+
+def _recording_stat(name):
+    return lambda: (AudioRecorder.recording_buffer.stats()[name] if AudioRecorder.recording_buffer else 0)
+
+
+metrics.gauge_fn('recording_buffer_samples', _recording_stat('available'))
+metrics.gauge_fn('recording_dropped_samples', _recording_stat('overflow_samples'))
+metrics.gauge_fn('recording_dropped_blocks', _recording_stat('overflow_count'))
+metrics.describe('recording_buffer_samples', "captured samples not written yet (record_unlimited)")
+metrics.describe('recording_dropped_blocks', "capture blocks (partly) dropped because the recording buffer was full")
+
+
+class RotatingSoundFile:
+    """
+    mono float32 samples to sound files (soundfile format / subtype), continued in a new file
+    (name_001.ext, name_002.ext...) once max_sec or max_bytes is reached
+    """
+
+    def __init__(self, filename, samplerate: int, file_format: tuple[str, str], max_sec=None, max_bytes=None):
+        self.path = Path(filename)
+        self.samplerate = samplerate
+        self.format, self.subtype = file_format
+        self.max_frames = int(max_sec * samplerate) if max_sec else None
+        self.max_bytes = max_bytes
+        self.rotating = bool(max_sec or max_bytes)
+        self.files = []
+        self.total_frames = 0
+        self._file = None
+
+    def _open(self):
+        name = self.path
+        if self.rotating:
+            name = self.path.with_name(f"{self.path.stem}_{len(self.files) + 1:03d}{self.path.suffix}")
+        self._file = sf.SoundFile(name, mode='w', samplerate=self.samplerate, channels=1,
+                                  format=self.format, subtype=self.subtype)
+        self.files.append(str(name))
+        metrics.inc('recording_files_total')
+        logger.info(f"writing '{name}'")
+
+    def _full(self) -> bool:
+        if self.max_frames and self._file.frames >= self.max_frames:
+            return True
+        return bool(self.max_bytes) and Path(self.files[-1]).stat().st_size >= self.max_bytes
+
+    @timed('recording_write')
+    def write(self, samples: np.ndarray):
+        pos = 0
+        while pos < len(samples):
+            if self._file is None:
+                self._open()
+            n = len(samples) - pos
+            if self.max_frames:
+                n = min(n, self.max_frames - self._file.frames)  # split exactly at max_sec
+            self._file.write(samples[pos:pos + n])
+            pos += n
+            if self._full():
+                self.close()
+        self.total_frames += len(samples)
+        metrics.inc('recorded_seconds_total', len(samples) / self.samplerate)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
 
 class AudioPlayer:
@@ -187,6 +342,7 @@ class AudioPlayer:
 
 class AudioEditor:
     @staticmethod
+    @timed('audio_segment')
     def audio_segment(audio_file, start_time_str="00:00", end_time_str=None, output_ext="wav") -> str:
 
         logger.info(f"segmenting '{audio_file}' {start_time_str}-{end_time_str}...")
@@ -222,6 +378,81 @@ class AudioEditor:
         logger.info(f"segment saved as '{out_filename}'")
         return out_filename
 
+    @staticmethod
+    def load_segment(audio_file, start_time_str=None, end_time_str=None, sr=16000) -> np.ndarray:
+        """
+        decode only the requested range (ffmpeg seeks in the input) to mono float32 at sr.
+        no temp file, nothing outside the range is decoded.
+        """
+        start_ms = to_ms(start_time_str) if start_time_str else 0
+        end_ms = to_ms(end_time_str) if end_time_str else None
+        if end_ms is not None and end_ms <= start_ms:
+            raise ValueError(f"end_time <= start_time. start: {start_ms}, end: {end_ms}")
+
+        logger.info(f"decoding '{audio_file}' {start_time_str}-{end_time_str}...")
+        audio = load_audio_range(audio_file, start_ms / 1000, end_ms / 1000 if end_ms is not None else None, sr)
+        if len(audio) == 0:
+            raise ValueError(f"start_time > audio duration. start: {start_ms} ms")
+
+        logger.info(f"segment: {len(audio) / sr:.1f} s")
+        return audio
+
+
+def normalize_inplace(audio: np.ndarray, chunk_frames=NORMALIZE_CHUNK_FRAMES) -> np.ndarray:
+    """
+    scale to full range (peak 1.0 for float, 32767 for int16) in place, chunk by chunk:
+    no full size temporary. silent input is left as is
+    """
+    peak = 0
+    for pos in range(0, len(audio), chunk_frames):
+        chunk = audio[pos:pos + chunk_frames]
+        peak = max(peak, float(chunk.max()), -float(chunk.min()))  # no abs(): int16 -32768 overflows
+    if peak == 0:
+        logger.warning("silent recording, not normalized")
+        return audio
+
+    if np.issubdtype(audio.dtype, np.integer):
+        scale = np.float32(np.iinfo(audio.dtype).max / peak)
+        for pos in range(0, len(audio), chunk_frames):
+            chunk = audio[pos:pos + chunk_frames]
+            np.clip(np.rint(chunk * scale), np.iinfo(audio.dtype).min, np.iinfo(audio.dtype).max, out=chunk,
+                    casting='unsafe')
+    else:
+        scale = audio.dtype.type(1 / peak)
+        for pos in range(0, len(audio), chunk_frames):
+            audio[pos:pos + chunk_frames] *= scale
+    return audio
+
+
+def load_audio_range(audio_file, start_sec=0.0, end_sec=None, sr=16000, out_file=None) -> np.ndarray:
+    """
+    mono float32 at sr, decoded by ffmpeg (like whisper.load_audio, for a time range).
+    out_file: decode to this file and return it memory-mapped (long audio, shared between readers).
+    """
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0"]
+    if start_sec:
+        cmd += ["-ss", f"{start_sec:.3f}"]  # before -i: seek in the input, don't decode what's skipped
+    if end_sec is not None:
+        cmd += ["-t", f"{end_sec - start_sec:.3f}"]
+    cmd += ["-i", str(audio_file), "-ac", "1", "-ar", str(sr)]
+
+    if out_file:
+        cmd += ["-y", "-f", "f32le", "-acodec", "pcm_f32le", str(out_file)]
+    else:
+        cmd += ["-f", "s16le", "-acodec", "pcm_s16le", "-"]
+
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"failed to load audio: {e.stderr.decode()}") from e
+
+    if out_file:
+        if Path(out_file).stat().st_size == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(out_file, dtype=np.float32, mode='c')  # copy on write, the file isn't modified
+
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
 
 def to_ms(time_str: str) -> int:
     """ (HH:MM:SS or MM:SS) to milliseconds"""
@@ -250,7 +481,7 @@ def get_now_str():
 
 
 if __name__ == '__main__':
-    mic_device_id = DeviceUtil.find_microphone_device(DeviceUtil.devices)
+    mic_device_id = DeviceUtil.find_microphone_device(DeviceUtil.get_devices())
     speakers_device_id = DeviceUtil.find_output_device()
     loopback_device_id = DeviceUtil.find_loopback_device()
 
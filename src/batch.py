@@ -0,0 +1,168 @@
+"""
+batch transcription.
+
+python -m src.batch INPUT [INPUT ...] [--out DIR] [--manifest FILE] [--timestamps] [--model NAME]
+
+INPUT: a directory (audio files in it), a glob pattern, a youtube url, or @file with one input per line.
+each finished input is appended to a jsonl manifest; a rerun with the same manifest skips completed inputs.
+the next input is downloaded/decoded while the current one is transcribed.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import whisper
+
+import src.transcribe as transcribe
+from src.result_cache import result_cache, file_hash
+from src.settings import TEMP_FILES_DIR
+from src.youtube_util import download_audio
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.opus', '.webm', '.mp4', '.mkv', '.aac'}
+PREFETCH = 1  # inputs prepared ahead of the one being transcribed
+
+
+def expand_inputs(inputs: list[str]) -> list[str]:
+    expanded = []
+    for item in inputs:
+        if item.startswith('@'):
+            lines = Path(item[1:]).read_text().splitlines()
+            expanded.extend(expand_inputs([line.strip() for line in lines if line.strip()]))
+        elif item.startswith(('http://', 'https://')):
+            expanded.append(item)
+        elif Path(item).is_dir():
+            expanded.extend(sorted(str(p) for p in Path(item).iterdir() if p.suffix.lower() in AUDIO_EXTENSIONS))
+        elif glob.has_magic(item):
+            expanded.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            expanded.append(item)
+
+    # keep order, drop duplicates
+    return list(dict.fromkeys(expanded))
+
+
+def read_manifest(manifest_file) -> set[str]:
+    """inputs completed in previous runs"""
+    done = set()
+    if not Path(manifest_file).is_file():
+        return done
+
+    for line in Path(manifest_file).read_text().splitlines():
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # partial line from a crash
+        if entry.get('status') == 'ok':
+            done.add(entry['input'])
+    return done
+
+
+def append_manifest(manifest_file, entry: dict):
+    with open(manifest_file, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def prepare(item: str) -> dict:
+    """download (urls), hash, and decode unless the result is cached. runs in the prefetch thread"""
+    start = time.perf_counter()
+    prepared = {'input': item, 'meta': None}
+
+    if item.startswith(('http://', 'https://')):
+        path, meta = download_audio(item, whisper_ready=True)
+        prepared['meta'] = meta
+    else:
+        path = item
+    prepared['path'] = path
+    prepared['hash'] = file_hash(path)
+    prepared['download_sec'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prepared['key'] = transcribe.result_key(prepared['hash'])
+    prepared['result'] = result_cache.get(prepared['key'])
+    if prepared['result'] is None:
+        prepared['audio'] = whisper.load_audio(path)
+        prepared['duration'] = len(prepared['audio']) / transcribe.WHISPER_SAMPLE_RATE
+    else:
+        segments = prepared['result']['segments']
+        prepared['duration'] = segments[-1]['end'] if segments else 0
+    prepared['decode_sec'] = time.perf_counter() - start
+    return prepared
+
+
+def process(prepared: dict, out_dir, show_timestamps) -> dict:
+    timings = {'download': prepared['download_sec'], 'decode': prepared['decode_sec']}
+
+    start = time.perf_counter()
+    result = prepared['result']
+    cached = result is not None
+    if not cached:
+        result = transcribe.transcribe_audio_data(prepared['audio'])
+        result_cache.put(prepared['key'], result)
+    timings['transcribe'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # content hash in the name: same stem in different directories, same video titles
+    name = f"{Path(prepared['path']).stem}_{prepared['hash'][:12]}"
+    out_file = transcribe.save_result(result, name, show_timestamps, out_dir=out_dir)
+    timings['write'] = time.perf_counter() - start
+
+    return {'input': prepared['input'], 'hash': prepared['hash'], 'duration': round(prepared['duration'], 2),
+            'timings': {k: round(v, 3) for k, v in timings.items()}, 'cached': cached, 'output': out_file}
+
+
+def run_batch(inputs: list[str], out_dir=TEMP_FILES_DIR, manifest_file=None, show_timestamps=False):
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    manifest_file = manifest_file or f"{out_dir}/manifest.jsonl"
+
+    items = expand_inputs(inputs)
+    done = read_manifest(manifest_file)
+    todo = [item for item in items if item not in done]
+    logger.info(f"{len(items)} inputs, {len(items) - len(todo)} already done, manifest: '{manifest_file}'")
+    if not todo:
+        return
+
+    transcribe.get_model()  # load once, before prefetching starts
+
+    with ThreadPoolExecutor(1, thread_name_prefix='prefetch') as executor:
+        pending = [executor.submit(prepare, item) for item in todo[:PREFETCH]]
+        next_idx = len(pending)
+
+        for i, item in enumerate(todo):
+            future = pending.pop(0)
+            if next_idx < len(todo):
+                pending.append(executor.submit(prepare, todo[next_idx]))
+                next_idx += 1
+
+            try:
+                entry = process(future.result(), out_dir, show_timestamps)
+                entry['status'] = 'ok'
+            except Exception as e:
+                logger.error(f"'{item}' failed: {e}", exc_info=True)
+                entry = {'input': item, 'status': 'error', 'error': str(e)}
+
+            entry['finished'] = time.time()
+            append_manifest(manifest_file, entry)
+            logger.info(f"[{i + 1}/{len(todo)}] {entry['status']}: '{item}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="batch transcription, resumable")
+    parser.add_argument('inputs', nargs='+', help="directories, globs, youtube urls, or @file_with_inputs")
+    parser.add_argument('--out', default=TEMP_FILES_DIR, help="output directory")
+    parser.add_argument('--manifest', default=None, help="jsonl manifest (default: <out>/manifest.jsonl)")
+    parser.add_argument('--timestamps', action='store_true', help="show timestamps")
+    parser.add_argument('--model', default=transcribe.model_name, help="whisper model name")
+    args = parser.parse_args()
+
+    transcribe.model_name = args.model
+    run_batch(args.inputs, args.out, args.manifest, args.timestamps)
@@ -0,0 +1,307 @@
+"""
+offline benchmarks: synthetic audio, stubbed input stream (no network, no audio hardware).
+
+python -m src.benchmark [--model tiny.en | --stub-model] [--duration 120] [--out bench.json]
+
+reports per stage: real-time factor (processing time / audio duration), latency percentiles (ms)
+and peak rss (MiB), as json. each stage runs in its own process: peak_rss_mib is that process' peak,
+peak_rss_delta_mib its growth during the stage (after imports and loading the synthetic audio).
+--model needs the whisper model in the local cache (~/.cache/whisper).
+--stub-model replaces whisper with a stub, measuring everything around inference.
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+import src.transcribe as transcribe
+from src.audio_util import AudioEditor, SAMPLE_RATE, to_ms
+from src.diarization_merge import merge_transcript
+from src.model_registry import registry, DEFAULT_DEVICE
+from src.resample import StreamingResampler
+from src.result_cache import ResultCache
+
+SR = transcribe.WHISPER_SAMPLE_RATE
+BLOCK_SIZE = 512  # frames per input callback
+SEGMENT_START, SEGMENT_END = '00:10', '01:00'
+STAGES = ('resample', 'audio_segment', 'load_segment', 'transcribe_file', 'transcribe_file_segment', 'real_time',
+          'diarization_merge')
+
+
+def synthetic_speech(duration_sec: float, sr: int, seed=0) -> np.ndarray:
+    """voiced bursts (harmonics, syllable rate amplitude modulation) separated by pauses, low noise floor"""
+    rng = np.random.default_rng(seed)
+    n = int(duration_sec * sr)
+    t = np.arange(n) / sr
+
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))  # ~4 syllables/s
+
+    gate = np.ones(n)
+    pos = int(rng.uniform(2, 6) * sr)
+    while pos < n:
+        pause = int(rng.uniform(0.5, 1.5) * sr)
+        gate[pos:pos + pause] = 0
+        pos += pause + int(rng.uniform(2, 6) * sr)
+
+    audio = 0.2 * voiced * envelope * gate + 0.002 * rng.standard_normal(n)
+    return audio.astype(np.float32)
+
+
+def latency_stats(seconds: list[float]) -> dict:
+    if not seconds:
+        return {}
+    ms = np.array(seconds) * 1000
+    return {'p50_ms': float(np.percentile(ms, 50)), 'p90_ms': float(np.percentile(ms, 90)),
+            'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max()), 'count': len(ms)}
+
+
+def peak_rss_mib() -> float:
+    """this process' peak rss. linux: VmHWM, ru_maxrss would include the parent's peak (vfork, exec)"""
+    status = Path('/proc/self/status')
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024  # KiB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macos, KiB on linux
+
+
+class StubModel:
+    """stands in for whisper: one fixed segment per call, no inference"""
+
+    def transcribe(self, audio, **kwargs):
+        duration = len(audio) / SR
+        return {'text': ' stub text', 'language': 'en',
+                'segments': [{'id': 0, 'start': 0.0, 'end': duration, 'text': ' stub text'}]}
+
+
+class FakeInputStream:
+    """sounddevice.InputStream stand-in: feeds `audio` to the callback from a thread, at real-time pace"""
+    audio = None
+    delivered = []  # (end sample, perf_counter time) per block
+
+    def __init__(self, samplerate, channels=1, callback=None, blocksize=BLOCK_SIZE, **kwargs):
+        self.samplerate = samplerate
+        self.callback = callback
+        self.blocksize = blocksize or BLOCK_SIZE
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        FakeInputStream.delivered = []
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        start = time.perf_counter()
+        for pos in range(0, len(self.audio), self.blocksize):
+            delay = start + pos / self.samplerate - time.perf_counter()
+            if self._stop.wait(max(0.0, delay)):
+                return
+            block = self.audio[pos:pos + self.blocksize, None]
+            self.callback(block, len(block), None, None)
+            self.delivered.append((pos + len(block), time.perf_counter()))
+
+
+def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_resample(audio_44k: np.ndarray) -> dict:
+    resampler = StreamingResampler(SAMPLE_RATE, SR)
+    block_times = []
+    for pos in range(0, len(audio_44k), BLOCK_SIZE):
+        block_times.append(timed(resampler.process, audio_44k[pos:pos + BLOCK_SIZE, None]))
+
+    duration = len(audio_44k) / SAMPLE_RATE
+    return {'rtf': sum(block_times) / duration, 'block_latency': latency_stats(block_times)}
+
+
+def bench_audio_segment(wav_file: str) -> dict:
+    start = time.perf_counter()
+    out_file = AudioEditor.audio_segment(wav_file, SEGMENT_START, SEGMENT_END)
+    elapsed = time.perf_counter() - start
+    Path(out_file).unlink()
+    return {'seconds': elapsed, 'rtf': elapsed / segment_duration()}
+
+
+def bench_load_segment(wav_file: str) -> dict:
+    elapsed = timed(AudioEditor.load_segment, wav_file, SEGMENT_START, SEGMENT_END, sr=SR)
+    return {'seconds': elapsed, 'rtf': elapsed / segment_duration()}
+
+
+def bench_transcribe_file(wav_file: str, duration: float) -> dict:
+    elapsed = timed(transcribe.transcribe_file, wav_file)
+    return {'seconds': elapsed, 'rtf': elapsed / duration}
+
+
+def bench_transcribe_file_segment(wav_file: str) -> dict:
+    elapsed = timed(transcribe.transcribe_file_segment, wav_file, SEGMENT_START, SEGMENT_END)
+    return {'seconds': elapsed, 'rtf': elapsed / segment_duration()}
+
+
+def bench_real_time(audio_16k: np.ndarray) -> dict:
+    """capture (stubbed stream at 16kHz) -> text latency of the real-time loop"""
+    FakeInputStream.audio = audio_16k
+    transcribe.sd.InputStream = FakeInputStream
+    transcribe.sd.sleep = lambda ms: time.sleep(ms / 1000)
+    transcribe.DeviceUtil.supports_samplerate = staticmethod(lambda *args, **kwargs: True)
+    transcribe.devices = {0: {'name': 'synthetic', 'max_input_channels': 1, 'default_samplerate': SR}}
+
+    texts = []  # (end sample, time)
+
+    def on_text(text, end_sample):
+        texts.append((end_sample, time.perf_counter()))
+
+    duration = len(audio_16k) / SR
+    stats = transcribe.record_and_transcribe_real_time(duration, 0, on_text=on_text)
+
+    # latency: text time - time the chunk's last sample was captured
+    delivered = np.array(FakeInputStream.delivered)
+    latencies = []
+    for end_sample, text_time in texts:
+        idx = min(np.searchsorted(delivered[:, 0], end_sample), len(delivered) - 1)
+        latencies.append(text_time - delivered[idx, 1])
+
+    return {'latency': latency_stats(latencies), 'buffer': stats['buffer']}
+
+
+def bench_merge(hours=3, num_speakers=4, seed=0) -> dict:
+    """word level speaker assignment for a long synthetic meeting"""
+    rng = np.random.default_rng(seed)
+    duration = hours * 3600
+
+    turn_starts = np.cumsum(rng.uniform(1, 10, int(duration / 5)))
+    turns = [[s, s + rng.uniform(1, 10), f"SPEAKER_{rng.integers(num_speakers):02d}"]
+             for s in turn_starts if s < duration]
+
+    word_starts = np.cumsum(rng.uniform(0.2, 0.5, int(duration * 3)))
+    word_starts = word_starts[word_starts < duration]
+    segments = []
+    for i in range(0, len(word_starts), 20):
+        words = [{'start': s, 'end': s + 0.2, 'word': ' w'} for s in word_starts[i:i + 20]]
+        segments.append({'start': words[0]['start'], 'end': words[-1]['end'], 'text': ' w' * len(words),
+                         'words': words})
+
+    elapsed = timed(merge_transcript, segments, turns)
+    return {'seconds': elapsed, 'rtf': elapsed / duration, 'turns': len(turns), 'words': len(word_starts)}
+
+
+def segment_duration() -> float:
+    return (to_ms(SEGMENT_END) - to_ms(SEGMENT_START)) / 1000
+
+
+def configure(model=None, stub_model=False):
+    if stub_model:
+        registry.get(('whisper', transcribe.model_name, DEFAULT_DEVICE, None), StubModel)
+        transcribe.PARALLEL_MIN_SEC = float('inf')  # worker processes would load the real model
+    elif model:
+        transcribe.model_name = model
+
+
+def prepare_inputs(inputs_dir: str, duration: float):
+    """synthetic audio for every stage, written once"""
+    audio_44k = synthetic_speech(duration, SAMPLE_RATE)
+    np.save(f"{inputs_dir}/audio_44k.npy", audio_44k)
+    np.save(f"{inputs_dir}/audio_16k.npy", synthetic_speech(duration, SR))
+    sf.write(f"{inputs_dir}/synthetic.wav", audio_44k, SAMPLE_RATE)
+
+
+def run_stage(name: str, inputs_dir: str, model=None, stub_model=False) -> dict:
+    """one stage, in this process, on the inputs written by prepare_inputs"""
+    configure(model, stub_model)
+    audio_44k = np.load(f"{inputs_dir}/audio_44k.npy")
+    audio_16k = np.load(f"{inputs_dir}/audio_16k.npy")
+    wav_file = f"{inputs_dir}/synthetic.wav"
+    duration = len(audio_16k) / SR
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        transcribe.result_cache = ResultCache(f"{tmp_dir}/cache")  # every run transcribes
+
+        stages = {
+            'resample': lambda: bench_resample(audio_44k),
+            'audio_segment': lambda: bench_audio_segment(wav_file),
+            'load_segment': lambda: bench_load_segment(wav_file),
+            'transcribe_file': lambda: bench_transcribe_file(wav_file, duration),
+            'transcribe_file_segment': lambda: bench_transcribe_file_segment(wav_file),
+            'real_time': lambda: bench_real_time(audio_16k),
+            'diarization_merge': lambda: bench_merge(),
+        }
+        baseline = peak_rss_mib()  # imports and inputs
+        try:
+            result = stages[name]()
+        except Exception as e:
+            result = {'error': str(e)}
+        result['peak_rss_mib'] = peak_rss_mib()
+        result['peak_rss_delta_mib'] = result['peak_rss_mib'] - baseline
+    return result
+
+
+def run(duration=120, model=None, stub_model=False) -> dict:
+    """every stage, each in a new process (ru_maxrss is a process-wide high-water mark)"""
+    results = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'device': DEFAULT_DEVICE,
+                 'model': 'stub' if stub_model else model or transcribe.model_name, 'audio_sec': duration,
+                 'time': time.time()},
+        'stages': {},
+    }
+
+    args = []
+    if stub_model:
+        args.append('--stub-model')
+    elif model:
+        args += ['--model', model]
+
+    with tempfile.TemporaryDirectory() as inputs_dir:
+        prepare_inputs(inputs_dir, duration)
+        for name in STAGES:
+            proc = subprocess.run([sys.executable, '-m', 'src.benchmark', '--stage', name, '--inputs', inputs_dir,
+                                   *args], capture_output=True, text=True)
+            if proc.returncode == 0:
+                results['stages'][name] = json.loads(proc.stdout.strip().splitlines()[-1])
+            else:
+                results['stages'][name] = {'error': (proc.stderr.strip().splitlines() or ['failed'])[-1]}
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="offline benchmarks")
+    parser.add_argument('--duration', type=float, default=120, help="synthetic audio seconds")
+    parser.add_argument('--model', default=None, help="whisper model (must be cached locally)")
+    parser.add_argument('--stub-model', action='store_true', help="no inference")
+    parser.add_argument('--out', default=None, help="json output file (default: stdout)")
+    parser.add_argument('--stage', choices=STAGES, default=None, help="run only this stage, in this process")
+    parser.add_argument('--inputs', default=None, help="with --stage: directory of the prepared inputs")
+    args = parser.parse_args()
+
+    if args.stage:
+        if not args.inputs:
+            parser.error("--stage needs --inputs")
+        print(json.dumps(run_stage(args.stage, args.inputs, args.model, args.stub_model)))
+        sys.exit()
+
+    res = run(args.duration, args.model, args.stub_model)
+    res_str = json.dumps(res, indent=2)
+    if args.out:
+        Path(args.out).write_text(res_str)
+    else:
+        print(res_str)
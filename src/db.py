@@ -1,47 +1,351 @@
 import logging
 
-from bson import ObjectId
-from pymongo import MongoClient
-from src.settings import CONN_STRING
+import gridfs
+from bson import Binary, ObjectId
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from src.metrics import timed
+from src.search_util import query_terms, result_snippet, encode_cursor, decode_cursor
+from src.settings import CONN_STRING, DB_POOL_SIZE, OFFLOAD_MIN_BYTES, SEARCH_TEXT_HEAD_CHARS
+from src.storage import (SEARCH_LIMIT, SEARCH_MAX_LIMIT, SEARCH_SEGMENTS_PER_RESULT, SEGMENTS_MAX_LIMIT,
+                         VersionConflict, content_hash, validate_edits, apply_edits, compress, decompress,
+                         make_search_text, max_segment_sec, segment_out)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-client = MongoClient(CONN_STRING, connectTimeoutMS=4_000, serverSelectionTimeoutMS=3_000)
-client.admin.command('ping')
-db = client['transcribe_db']
-transcripts_collection = db['transcripts']
-transcripts_collection.create_index([('title', 'text'), ('content', 'text')])
-logger.info("connected to MongoDB")
+# set by init()
+client = None
+db = None
+transcripts_collection = None
+segments_collection = None  # whisper segments, one document each: {transcript_id, start, end, text, speaker}
+bodies = None  # GridFS, offloaded (large) compressed bodies
 
-NUM_TEXT_RESULTS_LIMIT = 15
+# transcript body fields: content_z (compressed) or content_file (GridFS id), and search_text (indexed).
+# documents stored before compression have a plain `content` (see migrate)
+BODY_FIELDS = ('content', 'content_z', 'content_file', 'search_text')
+MIGRATE_BATCH = 100
 
 
-def save_transcript(doc: dict):
+def init(conn_string=CONN_STRING, pool_size=DB_POOL_SIZE):
+    """connect (pooled client, shared by all threads) and create indexes. call once, before the other functions"""
+    global client, db, transcripts_collection, segments_collection, bodies
+
+    client = MongoClient(conn_string, maxPoolSize=pool_size, connectTimeoutMS=4_000, serverSelectionTimeoutMS=3_000)
+    client.admin.command('ping')
+    db = client['transcribe_db']
+
+    transcripts_collection = db['transcripts']
+    # one text index per collection: the one on the full content (before compression) is replaced
+    for name, index in transcripts_collection.index_information().items():
+        if ('_fts', 'text') in index['key'] and 'content' in index.get('weights', {}):
+            transcripts_collection.drop_index(name)
+    transcripts_collection.create_index([('title', 'text'), ('search_text', 'text')])
+    # bulk ingest dedup
+    transcripts_collection.create_index([('source_id', 1), ('content_hash', 1)], unique=True,
+                                        partialFilterExpression={'content_hash': {'$exists': True}})
+
+    segments_collection = db['transcript_segments']
+    segments_collection.create_index([('text', 'text')])
+    segments_collection.create_index([('transcript_id', 1), ('start', 1)])
+
+    bodies = gridfs.GridFS(db, collection='transcript_bodies')
+    logger.info("connected to MongoDB")
+
+    if transcripts_collection.find_one({'content': {'$exists': True}}, {'_id': 1}):
+        logger.warning("transcripts stored before compression are not searchable, run: python -m src.storage migrate")
+
+
+def _body(content: str) -> dict:
+    """body fields for content: compressed, in the document or offloaded to GridFS"""
+    data = compress(content)
+    fields = {'search_text': make_search_text(content), 'content_size': len(content)}
+    if len(data) >= OFFLOAD_MIN_BYTES:
+        fields['content_file'] = bodies.put(data)
+    else:
+        fields['content_z'] = Binary(data)
+    return fields
+
+
+def _read_body(doc: dict) -> str:
+    if 'content_z' in doc:
+        return decompress(doc['content_z'])
+    if 'content_file' in doc:
+        return decompress(bodies.get(doc['content_file']).read())
+    return doc.get('content', '')  # stored before compression
+
+
+def _delete_body_file(doc: dict | None):
+    if doc and doc.get('content_file'):
+        bodies.delete(doc['content_file'])
+
+
+def _body_update(content: str) -> dict:
+    """update replacing the body fields (whichever the document has)"""
+    body = _body(content)
+    unset = {field: '' for field in BODY_FIELDS if field not in body}
+    return {'$set': body, '$unset': unset}
+
+
+def _segment_docs(transcript_id: ObjectId, segments: list[dict]) -> list[dict]:
+    docs = []
+    for segment in segments:
+        doc = {'transcript_id': transcript_id, 'start': float(segment['start']), 'end': float(segment['end']),
+               'text': segment['text']}
+        if segment.get('speaker'):
+            doc['speaker'] = segment['speaker']
+        docs.append(doc)
+    return docs
+
+
+@timed('db_save')
+def save_transcript(doc: dict, segments: list[dict] = None):
+    """compressed body in the document (or GridFS), one document per segment"""
+    doc = {**{k: v for k, v in doc.items() if k != 'content'}, **_body(doc['content'])}
+    doc['version'] = 1
+    if segments:
+        doc['num_segments'] = len(segments)
+        doc['max_segment_sec'] = max_segment_sec(segments)
     result = transcripts_collection.insert_one(doc)
-    logger.info(f"inserted transcript: {result.inserted_id}")
+    if segments:
+        segments_collection.insert_many(_segment_docs(result.inserted_id, segments), ordered=False)
+    logger.info(f"inserted transcript: {result.inserted_id} ({len(segments or [])} segments)")
     return str(result.inserted_id)
 
 
+@timed('db_save_bulk')
+def save_transcripts(items: list[dict], ordered=False) -> list[dict]:
+    """one bulk write of upserts ($setOnInsert: an existing match is left as is), then the new segments"""
+    if not items:
+        return []
+
+    keys, ops, docs = [], [], []
+    for item in items:
+        key = {'source_id': item.get('source_id'), 'content_hash': content_hash(item['content'])}
+        # key fields come from the filter
+        doc = {k: v for k, v in item.items() if k not in ('segments', 'source_id', 'content')}
+        doc.update(_body(item['content']))
+        doc['version'] = 1
+        docs.append(doc)
+        if item.get('segments'):
+            doc['num_segments'] = len(item['segments'])
+            doc['max_segment_sec'] = max_segment_sec(item['segments'])
+        keys.append(key)
+        ops.append(UpdateOne(key, {'$setOnInsert': doc}, upsert=True))
+
+    results = [{'index': i, 'status': 'exists'} for i in range(len(items))]
+    try:
+        bulk = transcripts_collection.bulk_write(ops, ordered=ordered)
+        upserted = bulk.upserted_ids
+    except BulkWriteError as e:
+        upserted = {op['index']: op['_id'] for op in e.details.get('upserted', [])}
+        for error in e.details.get('writeErrors', []):
+            results[error['index']].update(status='error', error=error.get('errmsg'))
+        if ordered:
+            first_error = min(error['index'] for error in e.details.get('writeErrors', []))
+            for result in results[first_error + 1:]:
+                result['status'] = 'skipped'
+
+    for i, _id in upserted.items():
+        results[i].update(status='inserted', id=str(_id))
+    for i, result in enumerate(results):
+        if result['status'] != 'inserted':
+            _delete_body_file(docs[i])  # offloaded body not used
+
+    # ids of items that were already stored
+    existing = [i for i, result in enumerate(results) if result['status'] == 'exists']
+    if existing:
+        found = transcripts_collection.find({'$or': [keys[i] for i in existing]},
+                                            {'_id': 1, 'source_id': 1, 'content_hash': 1})
+        ids = {(doc.get('source_id'), doc['content_hash']): str(doc['_id']) for doc in found}
+        for i in existing:
+            results[i]['id'] = ids.get((keys[i]['source_id'], keys[i]['content_hash']))
+
+    # segments of the new transcripts, one unordered insert
+    segment_docs = []
+    for i, _id in upserted.items():
+        if items[i].get('segments'):
+            segment_docs.extend(_segment_docs(_id, items[i]['segments']))
+    if segment_docs:
+        segments_collection.insert_many(segment_docs, ordered=False)
+
+    logger.info(f"bulk ingest: {len(items)} items, {len(upserted)} inserted")
+    return results
+
+
+@timed('db_get')
 def get_transcript(transcript_id: str):
-    res = transcripts_collection.find_one({'_id': ObjectId(transcript_id)})
+    res = transcripts_collection.find_one({'_id': ObjectId(transcript_id)}, {'search_text': 0})
+    if not res:
+        return None
+    res['content'] = _read_body(res)
+    res.pop('content_z', None)
+    res.pop('content_file', None)
     res['id'] = str(res['_id'])
     del res['_id']
+    res['version'] = res.get('version', 0)
     return res
 
 
-def search_transcripts(query):
-    results = transcripts_collection.find(
-        {'$text': {'$search': query}}, {'score': {'$meta': 'textScore'}}
-    ).sort([('score', {'$meta': 'textScore'})]).limit(NUM_TEXT_RESULTS_LIMIT)
+def get_version(transcript_id: str) -> int | None:
+    """projection on the version only"""
+    res = transcripts_collection.find_one({'_id': ObjectId(transcript_id)}, {'version': 1})
+    if not res:
+        return None
+    return res.get('version', 0)
+
+
+def _version_filter(transcript_id: str, version: int = None) -> dict:
+    query = {'_id': ObjectId(transcript_id)}
+    if version is not None:
+        query['version'] = version if version else None  # 0: saved before versioning (no field)
+    return query
+
+
+@timed('db_search')
+def search_transcripts(query: str, limit=SEARCH_LIMIT, cursor: str = None) -> tuple[list[dict], str | None]:
+    """$text search, by textScore. one aggregation: match, keyset cursor, sort, limit, projection"""
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    terms = query_terms(query)
+
+    pipeline = [
+        {'$match': {'$text': {'$search': query}}},
+        {'$addFields': {'score': {'$meta': 'textScore'}}},
+    ]
+    if cursor:
+        # keyset pagination: after (score, id) in (score desc, id asc) order
+        score, doc_id = decode_cursor(cursor)
+        if not ObjectId.is_valid(doc_id):
+            raise ValueError(f"invalid cursor: {cursor}")
+        pipeline.append({'$match': {'$or': [{'score': {'$lt': score}},
+                                            {'score': score, '_id': {'$gt': ObjectId(doc_id)}}]}})
+    pipeline += [
+        {'$sort': {'score': -1, '_id': 1}},
+        {'$limit': limit + 1},  # one extra: is there a next page
+        # snippets come from the head of search_text (cut by the server), the body is never read
+        {'$project': {'title': 1, 'src_type': 1, 'score': 1, 'content_size': 1,
+                      'head': {'$substrCP': ['$search_text', 0, SEARCH_TEXT_HEAD_CHARS]}}},
+    ]
+
+    docs = list(transcripts_collection.aggregate(pipeline))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    matches = _matching_segments(query, [doc['_id'] for doc in docs])
+    results = []
+    for doc in docs:
+        segments = matches.get(str(doc['_id']), [])
+        results.append({
+            'id': str(doc['_id']),
+            'title': doc.get('title'),
+            'src_type': doc.get('src_type', 'unknown'),
+            'score': doc['score'],
+            'snippet': result_snippet(doc['head'], terms, doc.get('content_size', len(doc['head'])), segments),
+            'segments': segments,
+        })
+
+    next_cursor = encode_cursor(docs[-1]['score'], str(docs[-1]['_id'])) if has_more else None
+    return results, next_cursor
+
+
+def _matching_segments(query: str, transcript_ids: list[ObjectId]) -> dict[str, list[dict]]:
+    """$text search on the segments of the page's transcripts, grouped per transcript. cost scales with the hits"""
+    if not transcript_ids:
+        return {}
+
+    pipeline = [
+        {'$match': {'$text': {'$search': query}, 'transcript_id': {'$in': transcript_ids}}},
+        {'$sort': {'score': {'$meta': 'textScore'}, 'start': 1}},
+        {'$group': {'_id': '$transcript_id',
+                    'segments': {'$push': {'start': '$start', 'end': '$end', 'text': '$text', 'speaker': '$speaker'}}}},
+        {'$project': {'segments': {'$slice': ['$segments', SEARCH_SEGMENTS_PER_RESULT]}}},
+    ]
+    return {str(doc['_id']): [segment_out(segment) for segment in doc['segments']]
+            for doc in segments_collection.aggregate(pipeline)}
+
+
+@timed('db_segments')
+def get_segments(transcript_id: str, start_sec: float = None, end_sec: float = None,
+                 limit=SEGMENTS_MAX_LIMIT) -> list[dict]:
+    """range on the (transcript_id, start) index, from start_sec - the transcript's max_segment_sec"""
+    query = {'transcript_id': ObjectId(transcript_id)}
+    start_range = {}
+    if start_sec is not None:
+        # segments starting up to max_segment_sec before the window may still overlap it
+        doc = transcripts_collection.find_one({'_id': ObjectId(transcript_id)}, {'max_segment_sec': 1})
+        if doc is None:
+            return []
+        start_range['$gte'] = start_sec - doc.get('max_segment_sec', 0)  # not set: no segments
+        query['end'] = {'$gt': start_sec}
+    if end_sec is not None:
+        start_range['$lt'] = end_sec
+    if start_range:
+        query['start'] = start_range
+
+    cursor = segments_collection.find(query, {'_id': 0, 'transcript_id': 0}).sort('start', 1)
+    return [segment_out(doc) for doc in cursor.limit(max(1, min(limit, SEGMENTS_MAX_LIMIT)))]
+
+
+@timed('db_update')
+def update_transcript(id, doc, segments: list[dict] = None, version: int = None) -> int | None:
+    """one find_one_and_update, conditional on the version. the previous offloaded body is deleted after"""
+    update = _body_update(doc['content'])
+    update['$inc'] = {'version': 1}
+    if segments is not None:
+        update['$set']['num_segments'] = len(segments)
+        update['$set']['max_segment_sec'] = max_segment_sec(segments)
+    # previous document: its offloaded body is deleted after the update
+    res = transcripts_collection.find_one_and_update(_version_filter(id, version), update,
+                                                     projection={'version': 1, 'content_file': 1},
+                                                     return_document=ReturnDocument.BEFORE)
+    if res is None:
+        _delete_body_file(update['$set'])
+        current = get_version(id)
+        if current is not None:
+            raise VersionConflict(current)
+        return None
+    _delete_body_file(res)
+    new_version = res.get('version', 0) + 1
+
+    if segments is not None:
+        segments_collection.delete_many({'transcript_id': ObjectId(id)})
+        if segments:
+            segments_collection.insert_many(_segment_docs(ObjectId(id), segments), ordered=False)
+
+    logger.info(f"updated transcript {id}, version {new_version}")
+    return new_version
+
+
+@timed('db_patch')
+def patch_transcript(id, edits: list[dict], version: int = None) -> int | None:
+    """
+    text range edits (see storage.validate_edits): the compressed body is read, edited and written back
+    by update_transcript, conditional on the version read
+    """
+    edits = validate_edits(edits)
+    doc = transcripts_collection.find_one({'_id': ObjectId(id)}, {'search_text': 0})
+    if doc is None:
+        return None
+    current = doc.get('version', 0)
+    if version is not None and current != version:
+        raise VersionConflict(current)
+
+    # conditional on the version read: a concurrent update in between is a conflict
+    new_version = update_transcript(id, {'content': apply_edits(_read_body(doc), edits)}, version=current)
+    logger.info(f"patched transcript {id} ({len(edits)} edits)")
+    return new_version
 
-    docs = [{'id': str(doc['_id']), 'title': doc['title'], 'content': doc['content'],
-             'src_type': doc.get('src_type', 'unknown')} for doc in results]
-    return docs
 
+def migrate() -> int:
+    """compress bodies of transcripts stored before compression (plain `content`). returns the number converted"""
+    migrated = 0
+    while True:
+        docs = list(transcripts_collection.find({'content': {'$exists': True}}, {'content': 1}).limit(MIGRATE_BATCH))
+        if not docs:
+            break
 
-def update_transcript(id, doc):
-    # update just the content
-    result = transcripts_collection.update_one({'_id': ObjectId(id)}, {'$set': {'content': doc['content']}})
-    logger.info(f"updated transcript: {result.modified_count}")
-    return result.modified_count
+        ops = [UpdateOne({'_id': doc['_id'], 'content': doc['content']}, _body_update(doc['content'])) for doc in docs]
+        result = transcripts_collection.bulk_write(ops, ordered=False)
+        migrated += result.modified_count
+        logger.info(f"migrated {migrated} transcripts")
+    return migrated
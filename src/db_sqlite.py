@@ -0,0 +1,429 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from src.metrics import timed
+from src.search_util import query_terms, result_snippet, encode_cursor, decode_cursor
+from src.settings import SQLITE_PATH, BLOB_DIR, OFFLOAD_MIN_BYTES, SEARCH_TEXT_HEAD_CHARS
+from src.storage import (SEARCH_LIMIT, SEARCH_MAX_LIMIT, SEARCH_SEGMENTS_PER_RESULT, SEGMENTS_MAX_LIMIT,
+                         VersionConflict, content_hash, validate_edits, apply_edits, compress, decompress,
+                         make_search_text, max_segment_sec, segment_out)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TITLE_WEIGHT = 2.0  # bm25 weight of title matches (content: 1)
+
+# transcripts body: content_z (zlib) or content_file (blob file in BLOB_DIR, large bodies), search_text is indexed.
+# fts5 tables are external content tables (no second copy of the text), kept in sync by triggers:
+# every insert / update / delete of a row updates only that row's index entries
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    title TEXT,
+    content_z BLOB,
+    content_file TEXT,
+    search_text TEXT NOT NULL,
+    content_size INTEGER,
+    src_type TEXT,
+    channel TEXT,
+    num_segments INTEGER,
+    max_segment_sec REAL,
+    created REAL,
+    source_id TEXT,
+    content_hash TEXT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+    title, search_text, content='transcripts', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS transcripts_ai AFTER INSERT ON transcripts BEGIN
+    INSERT INTO transcripts_fts(rowid, title, search_text) VALUES (new.id, new.title, new.search_text);
+END;
+CREATE TRIGGER IF NOT EXISTS transcripts_ad AFTER DELETE ON transcripts BEGIN
+    INSERT INTO transcripts_fts(transcripts_fts, rowid, title, search_text)
+        VALUES ('delete', old.id, old.title, old.search_text);
+END;
+CREATE TRIGGER IF NOT EXISTS transcripts_au AFTER UPDATE OF title, search_text ON transcripts BEGIN
+    INSERT INTO transcripts_fts(transcripts_fts, rowid, title, search_text)
+        VALUES ('delete', old.id, old.title, old.search_text);
+    INSERT INTO transcripts_fts(rowid, title, search_text) VALUES (new.id, new.title, new.search_text);
+END;
+
+CREATE UNIQUE INDEX IF NOT EXISTS transcripts_source ON transcripts(ifnull(source_id, ''), content_hash)
+    WHERE content_hash IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    transcript_id INTEGER NOT NULL REFERENCES transcripts(id) ON DELETE CASCADE,
+    start REAL NOT NULL,
+    "end" REAL NOT NULL,
+    text TEXT NOT NULL,
+    speaker TEXT
+);
+CREATE INDEX IF NOT EXISTS segments_transcript_start ON segments(transcript_id, start);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+    text, content='segments', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts(segments_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+BODY_COLUMNS = ('content_z', 'content_file', 'search_text')
+
+_local = threading.local()  # one connection per thread
+db_path = SQLITE_PATH  # set by init()
+blob_dir = BLOB_DIR
+
+
+def init(path=SQLITE_PATH, blobs=BLOB_DIR):
+    """create the db file and schema. call once, before the other functions"""
+    global db_path, blob_dir
+    db_path, blob_dir = path, blobs
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(blobs).mkdir(parents=True, exist_ok=True)
+
+    conn = _open(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+    logger.info(f"sqlite db: '{path}'")
+
+
+def migrate() -> int:
+    """nothing to convert: sqlite dbs have compressed bodies from the start"""
+    return 0
+
+
+def _body(content: str) -> dict:
+    """body columns for content: compressed, in the row or in a blob file"""
+    data = compress(content)
+    fields = {'search_text': make_search_text(content), 'content_size': len(content),
+              'content_z': None, 'content_file': None}
+    if len(data) >= OFFLOAD_MIN_BYTES:
+        name = f"{uuid.uuid4().hex}.z"
+        tmp_path = Path(blob_dir) / f"{name}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, Path(blob_dir) / name)
+        fields['content_file'] = name
+    else:
+        fields['content_z'] = data
+    return fields
+
+
+def _read_body(row) -> str:
+    if row['content_z'] is not None:
+        return decompress(row['content_z'])
+    return decompress((Path(blob_dir) / row['content_file']).read_bytes())
+
+
+def _delete_body_file(name: str | None):
+    if name:
+        (Path(blob_dir) / name).unlink(missing_ok=True)
+
+
+def _open(path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def connect() -> sqlite3.Connection:
+    """this thread's connection (opened on first use)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != db_path:
+        conn = _local.conn = _open(db_path)
+        _local.path = db_path
+    return conn
+
+
+def _row_id(transcript_id) -> int | None:
+    try:
+        return int(transcript_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def fts_query(query: str) -> str:
+    """
+    search box query -> fts5 match expression.
+    "quoted phrase" (required), word* (prefix), -word (excluded), other words: any of them (also with phrases,
+    so they still count for bm25). every token is quoted, so user input can't produce an fts5 syntax error.
+    """
+    phrases, words, excluded = [], [], []
+    for phrase, token in re.findall(r'"([^"]*)"|(\S+)', query):
+        if phrase.strip():
+            phrases.append('"' + phrase.strip().replace('"', '""') + '"')
+            continue
+        negated = token.startswith('-')
+        prefix = token.endswith('*')
+        token = token.strip('-*"')
+        if not token:
+            continue
+        term = '"' + token.replace('"', '""') + '"' + ('*' if prefix else '')
+        (excluded if negated else words).append(term)
+
+    if not phrases and not words:
+        raise ValueError(f"no search terms in query: {query}")
+    expr = ' OR '.join(words)
+    if phrases:
+        expr = ' AND '.join(phrases + ([f"({expr})"] if words else []))
+    if excluded:
+        expr = f"({expr})" + ''.join(f" NOT {term}" for term in excluded)
+    return expr
+
+
+def _insert_segments(conn, transcript_id: int, segments: list[dict]):
+    conn.executemany(
+        'INSERT INTO segments (transcript_id, start, "end", text, speaker) VALUES (?, ?, ?, ?, ?)',
+        [(transcript_id, float(s['start']), float(s['end']), s['text'], s.get('speaker')) for s in segments])
+
+
+@timed('db_save')
+def save_transcript(doc: dict, segments: list[dict] = None):
+    """one transaction: the row (indexed by trigger) and its segments"""
+    body = _body(doc['content'])
+    conn = connect()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO transcripts (title, content_z, content_file, search_text, content_size, src_type, channel, "
+            "num_segments, max_segment_sec, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (doc.get('title'), body['content_z'], body['content_file'], body['search_text'], body['content_size'],
+             doc.get('src_type'), doc.get('channel'), len(segments) if segments else None,
+             max_segment_sec(segments) if segments else None, time.time()))
+        if segments:
+            _insert_segments(conn, cur.lastrowid, segments)
+    logger.info(f"inserted transcript: {cur.lastrowid} ({len(segments or [])} segments)")
+    return str(cur.lastrowid)
+
+
+@timed('db_save_bulk')
+def save_transcripts(items: list[dict], ordered=False) -> list[dict]:
+    """one transaction, a savepoint per item. existing items: found by the transcripts_source index"""
+    conn = connect()
+    results = []
+    inserted = 0
+    written = []  # blob files of the inserted items, deleted if the transaction doesn't commit
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # dedup checks and inserts without another writer in between
+            for i, item in enumerate(items):
+                if ordered and results and results[-1]['status'] == 'error':
+                    results.extend({'index': j, 'status': 'skipped'} for j in range(i, len(items)))
+                    break
+
+                source_id, c_hash = item.get('source_id'), content_hash(item['content'])
+                row = conn.execute("SELECT id FROM transcripts WHERE ifnull(source_id, '') = ? AND content_hash = ?",
+                                   (source_id or '', c_hash)).fetchone()
+                if row:
+                    results.append({'index': i, 'status': 'exists', 'id': str(row['id'])})
+                    continue
+
+                segments = item.get('segments')
+                body = _body(item['content'])
+                try:
+                    conn.execute("SAVEPOINT item")  # a failed item leaves nothing behind
+                    cur = conn.execute(
+                        "INSERT INTO transcripts (title, content_z, content_file, search_text, content_size, src_type, "
+                        "channel, num_segments, max_segment_sec, created, source_id, content_hash) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (item.get('title'), body['content_z'], body['content_file'], body['search_text'],
+                         body['content_size'], item.get('src_type'), item.get('channel'),
+                         len(segments) if segments else None, max_segment_sec(segments) if segments else None,
+                         time.time(), source_id, c_hash))
+                    if segments:
+                        _insert_segments(conn, cur.lastrowid, segments)
+                    conn.execute("RELEASE item")
+                    results.append({'index': i, 'status': 'inserted', 'id': str(cur.lastrowid)})
+                    written.append(body['content_file'])
+                    inserted += 1
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO item")
+                    conn.execute("RELEASE item")
+                    _delete_body_file(body['content_file'])
+                    results.append({'index': i, 'status': 'error', 'error': str(e)})
+    except Exception:
+        for name in written:
+            _delete_body_file(name)
+        raise
+
+    logger.info(f"bulk ingest: {len(items)} items, {inserted} inserted")
+    return results
+
+
+@timed('db_get')
+def get_transcript(transcript_id: str):
+    row_id = _row_id(transcript_id)
+    row = connect().execute("SELECT * FROM transcripts WHERE id = ?", (row_id,)).fetchone()
+    if not row:
+        return None
+    res = {k: row[k] for k in row.keys() if row[k] is not None and k not in (*BODY_COLUMNS, 'id')}
+    res['content'] = _read_body(row)
+    res['id'] = str(row['id'])
+    return res
+
+
+def _write_body(conn, row_id: int, content: str) -> str | None:
+    """replace a row's body (and its index entries), version + 1. returns the replaced blob file, if any"""
+    old_file = conn.execute("SELECT content_file FROM transcripts WHERE id = ?", (row_id,)).fetchone()['content_file']
+    body = _body(content)
+    conn.execute("UPDATE transcripts SET content_z = ?, content_file = ?, search_text = ?, content_size = ?, "
+                 "version = version + 1 WHERE id = ?",
+                 (body['content_z'], body['content_file'], body['search_text'], body['content_size'], row_id))
+    return old_file
+
+
+def get_version(transcript_id: str) -> int | None:
+    row = connect().execute("SELECT version FROM transcripts WHERE id = ?", (_row_id(transcript_id),)).fetchone()
+    return row['version'] if row else None
+
+
+def _check_version(conn, row_id: int, version: int = None) -> bool:
+    """False if not found, VersionConflict if the version isn't the expected one"""
+    row = conn.execute("SELECT version FROM transcripts WHERE id = ?", (row_id,)).fetchone()
+    if not row:
+        return False
+    if version is not None and row['version'] != version:
+        raise VersionConflict(row['version'])
+    return True
+
+
+@timed('db_search')
+def search_transcripts(query: str, limit=SEARCH_LIMIT, cursor: str = None) -> tuple[list[dict], str | None]:
+    """fts5, by bm25 (title matches weighted TITLE_WEIGHT). the page's ids first, details only for them"""
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    match = fts_query(query)
+    conn = connect()
+
+    # page of ids first, snippets only for the page
+    after = ''
+    params = [TITLE_WEIGHT, match]
+    if cursor:
+        # keyset pagination: after (score, id) in (score desc, id asc) order
+        score, doc_id = decode_cursor(cursor)
+        if _row_id(doc_id) is None:
+            raise ValueError(f"invalid cursor: {cursor}")
+        after = "WHERE score < ? OR (score = ? AND id > ?)"
+        params += [score, score, _row_id(doc_id)]
+
+    rows = conn.execute(f"""
+        SELECT * FROM (
+            SELECT rowid AS id, -bm25(transcripts_fts, ?, 1.0) AS score FROM transcripts_fts
+            WHERE transcripts_fts MATCH ?
+        ) {after}
+        ORDER BY score DESC, id LIMIT ?""", (*params, limit + 1)).fetchall()  # one extra: is there a next page
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], None
+
+    ids = [row['id'] for row in rows]
+    placeholders = ','.join('?' * len(ids))
+    details = {row['id']: row for row in conn.execute(f"""
+        SELECT id, title, src_type, content_size, substr(search_text, 1, ?) AS head
+        FROM transcripts WHERE id IN ({placeholders})""", (SEARCH_TEXT_HEAD_CHARS, *ids))}
+
+    # snippets from the head of search_text, or the matching segments (the body is never read)
+    terms = query_terms(query)
+    matches = _matching_segments(match, ids)
+    results = [{
+        'id': str(row['id']),
+        'title': details[row['id']]['title'],
+        'src_type': details[row['id']]['src_type'] or 'unknown',
+        'score': row['score'],
+        'snippet': result_snippet(details[row['id']]['head'], terms, details[row['id']]['content_size'],
+                                  matches.get(row['id'], [])),
+        'segments': matches.get(row['id'], []),
+    } for row in rows]
+
+    next_cursor = encode_cursor(rows[-1]['score'], str(rows[-1]['id'])) if has_more else None
+    return results, next_cursor
+
+
+def _matching_segments(match: str, transcript_ids: list[int]) -> dict[int, list[dict]]:
+    """segments_fts matches of the page's transcripts, the best per transcript (row_number by bm25)"""
+    placeholders = ','.join('?' * len(transcript_ids))
+    rows = connect().execute(f"""
+        SELECT * FROM (
+            SELECT s.transcript_id, s.start, s."end", s.text, s.speaker,
+                   row_number() OVER (PARTITION BY s.transcript_id ORDER BY bm25(segments_fts), s.start) AS n
+            FROM segments_fts JOIN segments s ON s.id = segments_fts.rowid
+            WHERE segments_fts MATCH ? AND s.transcript_id IN ({placeholders})
+        ) WHERE n <= ?""", (match, *transcript_ids, SEARCH_SEGMENTS_PER_RESULT))
+
+    matches = {}
+    for row in rows:
+        matches.setdefault(row['transcript_id'], []).append(segment_out(row))
+    return matches
+
+
+@timed('db_segments')
+def get_segments(transcript_id: str, start_sec: float = None, end_sec: float = None,
+                 limit=SEGMENTS_MAX_LIMIT) -> list[dict]:
+    """range on the segments (transcript_id, start) index, from start_sec - the transcript's max_segment_sec"""
+    row_id = _row_id(transcript_id)
+    where = ["transcript_id = ?"]
+    params = [row_id]
+    if start_sec is not None:
+        # segments starting up to max_segment_sec before the window may still overlap it
+        where.append('start >= ? - (SELECT ifnull(max_segment_sec, 0) FROM transcripts WHERE id = ?) AND "end" > ?')
+        params += [start_sec, row_id, start_sec]
+    if end_sec is not None:
+        where.append("start < ?")
+        params.append(end_sec)
+
+    rows = connect().execute(
+        f'SELECT start, "end", text, speaker FROM segments WHERE {" AND ".join(where)} ORDER BY start LIMIT ?',
+        (*params, max(1, min(limit, SEGMENTS_MAX_LIMIT))))
+    return [segment_out(row) for row in rows]
+
+
+@timed('db_update')
+def update_transcript(id, doc, segments: list[dict] = None, version: int = None) -> int | None:
+    """BEGIN IMMEDIATE: version check and write with no other writer in between. reindexes just this row"""
+    row_id = _row_id(id)
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")  # version check and update without another writer in between
+        if not _check_version(conn, row_id, version):
+            return None
+        old_file = _write_body(conn, row_id, doc['content'])
+        if segments is not None:
+            conn.execute("UPDATE transcripts SET num_segments = ?, max_segment_sec = ? WHERE id = ?",
+                         (len(segments), max_segment_sec(segments), row_id))
+            conn.execute("DELETE FROM segments WHERE transcript_id = ?", (row_id,))
+            _insert_segments(conn, row_id, segments)
+        new_version = conn.execute("SELECT version FROM transcripts WHERE id = ?", (row_id,)).fetchone()['version']
+    _delete_body_file(old_file)  # after the commit: a failed update still has its body
+    logger.info(f"updated transcript {id}, version {new_version}")
+    return new_version
+
+
+@timed('db_patch')
+def patch_transcript(id, edits: list[dict], version: int = None) -> int | None:
+    """text range edits (see storage.validate_edits), applied within the write transaction"""
+    edits = validate_edits(edits)
+    row_id = _row_id(id)
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not _check_version(conn, row_id, version):
+            return None
+        row = conn.execute("SELECT content_z, content_file FROM transcripts WHERE id = ?", (row_id,)).fetchone()
+        old_file = _write_body(conn, row_id, apply_edits(_read_body(row), edits))
+        new_version = conn.execute("SELECT version FROM transcripts WHERE id = ?", (row_id,)).fetchone()['version']
+    _delete_body_file(old_file)
+    logger.info(f"patched transcript {id} ({len(edits)} edits), version {new_version}")
+    return new_version
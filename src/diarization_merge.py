@@ -0,0 +1,116 @@
+import numpy as np
+
+from src.audio_util import to_str_hhmmss
+
+UNKNOWN_SPEAKER = 'UNKNOWN'
+MIN_TURN_SEC = 0.01  # shorter turns are grouped with these
+
+
+def assign_speakers(turns: list[list], starts: np.ndarray, ends: np.ndarray) -> list[str]:
+    """
+    speaker with maximal total overlap for each [start, end] interval.
+    intervals that overlap no turn get the nearest turn's speaker.
+
+    turns: [start, end, speaker] (any order, may overlap).
+    vectorized: turns are grouped by duration (powers of 2), and in each group an interval only looks at
+    the turns starting at most the group's longest turn before it (sorted turns + binary search).
+    a long turn (background speaker, overlapping speech) only widens the window of its own group,
+    so this stays linear in practice for long meetings with many turns.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(starts) == 0:
+        return []
+    if not turns:
+        return [UNKNOWN_SPEAKER] * len(starts)
+
+    # turns sorted by start
+    t_start = np.array([turn[0] for turn in turns], dtype=np.float64)
+    order = np.argsort(t_start, kind='stable')
+    t_start = t_start[order]
+    t_end = np.array([turn[1] for turn in turns], dtype=np.float64)[order]
+    labels, t_speaker = np.unique(np.array([turn[2] for turn in turns])[order], return_inverse=True)
+
+    # total overlap per speaker
+    scores = np.zeros((len(starts), len(labels)))
+    durations = np.maximum(t_end - t_start, 0)
+    _, group = np.frexp(np.maximum(durations, MIN_TURN_SEC))
+    for g in np.unique(group):
+        members = np.flatnonzero(group == g)  # still sorted by start
+        g_start = t_start[members]
+
+        # candidate turns for interval i: members[lo[i]:hi[i]]
+        # turns of the group starting before lo end before the interval starts, turns from hi start after it ends
+        lo = np.searchsorted(g_start, starts - durations[members].max(), side='left')
+        hi = np.searchsorted(g_start, ends, side='left')
+        counts = np.maximum(hi - lo, 0)
+
+        # (interval, turn) pairs
+        interval_idx = np.repeat(np.arange(len(starts)), counts)
+        first_pair = np.repeat(np.cumsum(counts) - counts, counts)
+        turn_idx = members[np.repeat(lo, counts) + (np.arange(counts.sum()) - first_pair)]
+
+        overlap = np.minimum(ends[interval_idx], t_end[turn_idx]) - np.maximum(starts[interval_idx], t_start[turn_idx])
+        np.add.at(scores, (interval_idx, t_speaker[turn_idx]), np.clip(overlap, 0, None))
+
+    best = scores.argmax(axis=1)
+
+    # no overlap: nearest turn (by distance between the interval midpoint and the turn)
+    no_overlap = scores[np.arange(len(starts)), best] <= 0
+    if no_overlap.any():
+        mids = (starts[no_overlap] + ends[no_overlap]) / 2
+        after = np.clip(np.searchsorted(t_start, mids), 0, len(t_start) - 1)
+        before = np.clip(after - 1, 0, len(t_start) - 1)
+        dist_after = np.maximum(t_start[after] - mids, 0)
+        dist_before = np.maximum(mids - t_end[before], 0)
+        nearest = np.where(dist_before <= dist_after, before, after)
+        best[no_overlap] = t_speaker[nearest]
+
+    return labels[best].tolist()
+
+
+def merge_transcript(segments: list[dict], turns: list[list]) -> list[dict]:
+    """
+    whisper segments + speaker turns -> utterances [{'speaker', 'start', 'end', 'text'}].
+    words are assigned individually when segments have word timestamps, so a segment spanning
+    a speaker change is split.
+    """
+    items = []  # (start, end, text)
+    for segment in segments:
+        if segment.get('words'):
+            items.extend((w['start'], w['end'], w['word']) for w in segment['words'])
+        else:
+            items.append((segment['start'], segment['end'], segment['text']))
+
+    if not items:
+        return []
+
+    speakers = assign_speakers(turns, [item[0] for item in items], [item[1] for item in items])
+
+    utterances = []
+    for (start, end, text), speaker in zip(items, speakers):
+        if utterances and utterances[-1]['speaker'] == speaker:
+            utterances[-1]['end'] = end
+            utterances[-1]['text'] += text
+        else:
+            utterances.append({'speaker': speaker, 'start': start, 'end': end, 'text': text})
+
+    return utterances
+
+
+def format_utterances(utterances: list[dict], timestamp_freq_sec: int) -> str:
+    """'SPEAKER: text' lines, with a timestamp line about every timestamp_freq_sec"""
+    transcription = []
+    timestamp_iter_num = 1
+
+    for utterance in utterances:
+        if transcription:
+            transcription.append("\n")
+
+        if utterance['start'] > (timestamp_iter_num * timestamp_freq_sec):
+            timestamp_iter_num += 1
+            transcription.append(f"\n{to_str_hhmmss(utterance['start'])}\n\n")
+
+        transcription.append(f"{utterance['speaker']}: {utterance['text']}")
+
+    return ''.join(transcription)
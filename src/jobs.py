@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from src.metrics import timed
+from src.settings import JOB_WORKERS, MAX_QUEUED_JOBS, JOB_HISTORY, DEVICE_CONCURRENCY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'  # queued, running, done, error
+        self.stage = None  # e.g. 'downloading', 'transcribing'
+        self.progress = 0.0  # 0-1
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def update(self, stage=None, progress=None):
+        if stage is not None:
+            self.stage = stage
+        if progress is not None:
+            self.progress = progress
+
+    def to_dict(self, with_result=False) -> dict:
+        d = {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.error:
+            d['error'] = self.error
+        if with_result:
+            d['result'] = self.result
+        return d
+
+
+class JobQueue:
+    """
+    bounded worker pool. jobs get the Job as first argument (to report stage/progress).
+    model inference inside a job should hold `device_slot(device)`, limiting concurrent use of each device.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS, history=JOB_HISTORY,
+                 device_concurrency=DEVICE_CONCURRENCY):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='job')
+        self.max_queued = max_queued
+        self.history = history
+        self._device_slots = {dev: threading.BoundedSemaphore(n) for dev, n in device_concurrency.items()}
+        self._jobs = OrderedDict()  # id -> Job
+        self._lock = threading.Lock()
+
+    def counts(self) -> dict:
+        """number of jobs per status"""
+        with self._lock:
+            counts = dict.fromkeys(('queued', 'running', 'done', 'error'), 0)
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def submit(self, fn, *args, **kwargs) -> Job:
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.status in ('queued', 'running'))
+            if pending >= self.max_queued:
+                raise QueueFullError(f"too many pending jobs ({pending})")
+
+            job = Job()
+            self._jobs[job.id] = job
+            self._trim_history()
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info(f"job {job.id} queued ({fn.__name__})")
+        return job
+
+    def get(self, job_id) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @contextmanager
+    def device_slot(self, device: str):
+        slot = self._device_slots.get(device)
+        if slot is None:
+            yield
+            return
+
+        with timed('device_wait'):
+            slot.acquire()
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = 'error'
+        finally:
+            job.finished = time.time()
+            logger.info(f"job {job.id} {job.status} in {job.finished - job.started:.1f} s")
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'error')]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PREFIX = 'transcriber_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# stage timings of the current request/job (see collect_timings)
+_timings: ContextVar[list | None] = ContextVar('timings', default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_str(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    """
+    in-process counters, gauges and histograms, rendered in prometheus text format.
+    cheap enough for hot paths: one lock, dict lookups, no allocation per observation beyond the key.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # (name, labels) -> value
+        self._gauge_fns = {}  # name -> fn() -> value, or {labels dict as tuple: value}
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def gauge_fn(self, name: str, fn):
+        """gauge read at collection time. fn() returns a value, or {labels tuple: value}"""
+        self._gauge_fns[name] = fn
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            hist[idx] += 1  # cumulated when rendered
+            hist[-2] += value
+            hist[-1] += 1
+
+    @contextmanager
+    def timed(self, stage: str):
+        """time a stage: stage_seconds histogram, and the current request's timings (Server-Timing)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('stage_seconds', elapsed, stage=stage)
+            timings = _timings.get()
+            if timings is not None:
+                timings.append((stage, elapsed))
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def render(self) -> str:
+        """prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: list(hist) for key, hist in self._histograms.items()}
+
+        for name, fn in self._gauge_fns.items():
+            value = fn()
+            if isinstance(value, dict):
+                gauges.update({(name, labels): v for labels, v in value.items()})
+            else:
+                gauges[(name, ())] = value
+
+        lines = []
+        for kind, samples in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in samples}):
+                self._header(lines, name, kind)
+                for (n, labels), value in sorted(samples.items(), key=lambda item: str(item[0])):
+                    if n == name:
+                        lines.append(f"{PREFIX}{name}{_labels_str(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            self._header(lines, name, 'histogram')
+            for (n, labels), hist in sorted(histograms.items(), key=lambda item: str(item[0])):
+                if n != name:
+                    continue
+                cumulative = 0
+                for le, count in zip((*self.buckets, '+Inf'), hist[:-2]):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_labels_str((*labels, ('le', le)))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_labels_str(labels)} {hist[-2]}")
+                lines.append(f"{PREFIX}{name}_count{_labels_str(labels)} {hist[-1]}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines: list, name: str, kind: str):
+        if name in self._help:
+            lines.append(f"# HELP {PREFIX}{name} {self._help[name]}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+
+def start_timings() -> list:
+    """new timings list for the current context (e.g. a request), filled by `timed`"""
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def total_timings(timings: list) -> dict:
+    """{stage: seconds}, repeated stages summed"""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0) + seconds
+    return totals
+
+
+@contextmanager
+def collect_timings():
+    """stage timings recorded (by `timed`) in this context, as a list of (stage, seconds)"""
+    timings = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing(timings: list) -> str:
+    """Server-Timing header value, e.g. 'upload_save;dur=12.3, db_save;dur=4.1'"""
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in total_timings(timings).items())
+
+
+metrics = Metrics()
+timed = metrics.timed
+metrics.describe('stage_seconds', "time spent per stage (download, decode, inference, db...)")
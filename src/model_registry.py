@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+import whisper
+
+from src.settings import MODEL_CACHE_MAX_MODELS, MODEL_CACHE_MAX_BYTES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def model_nbytes(model) -> int:
+    """parameters + buffers size (0 for objects that are not torch modules)"""
+    if not isinstance(model, torch.nn.Module):
+        return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    """
+    models loaded on first use and shared across modules.
+    least recently used models are evicted when over max_models or max_bytes.
+    a model instance runs one call at a time: callers hold `exclusive(model)` while using it.
+    """
+
+    def __init__(self, max_models=MODEL_CACHE_MAX_MODELS, max_bytes=MODEL_CACHE_MAX_BYTES):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()  # key -> (model, nbytes)
+        self._lock = threading.Lock()
+        self._load_locks = {}  # key -> lock, so a model is loaded once even with concurrent callers
+        self._use_locks = weakref.WeakKeyDictionary()  # model -> lock held while it runs
+
+    def get(self, key: tuple, loader, size_fn=model_nbytes):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    return self._models[key][0]
+
+            start = time.perf_counter()
+            model = loader()
+            nbytes = size_fn(model)
+            logger.info(f"loaded {key} in {time.perf_counter() - start:.1f} s ({nbytes / 1024 ** 2:.0f} MiB)")
+
+            with self._lock:
+                self._models[key] = (model, nbytes)
+                self._evict(keep=key)
+        return model
+
+    @contextmanager
+    def exclusive(self, model):
+        """
+        hold while running the model. whisper's decoder installs kv-cache hooks on the model's modules
+        during each transcribe call, so concurrent calls on the same instance would mix their caches
+        """
+        with self._lock:
+            lock = self._use_locks.setdefault(model, threading.Lock())
+        with lock:
+            yield model
+
+    def whisper(self, name: str, device: str = None, dtype: str = None):
+        """dtype: None (as loaded, float32) or 'float16'"""
+        device = device or DEFAULT_DEVICE
+
+        def load():
+            model = whisper.load_model(name, device=device)
+            if dtype == 'float16':
+                model = model.half()
+            return model
+
+        return self.get(('whisper', name, device, dtype), load)
+
+    def warm_up(self, names: list[str], device: str = None, dtype: str = None):
+        """load models ahead of the first request"""
+        for name in names:
+            self.whisper(name, device, dtype)
+
+    def loaded(self) -> list[tuple]:
+        with self._lock:
+            return list(self._models)
+
+    def _evict(self, keep):
+        def over_budget():
+            total = sum(nbytes for _, nbytes in self._models.values())
+            return len(self._models) > self.max_models or total > self.max_bytes
+
+        evicted = False
+        while over_budget() and len(self._models) > 1:
+            key = next(iter(self._models))
+            if key == keep:
+                break
+            del self._models[key]
+            evicted = True
+            logger.info(f"evicted {key}")
+
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+registry = ModelRegistry()
+
+
+def get_whisper_model(name: str, device: str = None, dtype: str = None):
+    return registry.whisper(name, device, dtype)
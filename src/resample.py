@@ -0,0 +1,38 @@
+import numpy as np
+import soxr  # polyphase resampler (also used by librosa)
+
+
+def to_mono(block: np.ndarray) -> np.ndarray:
+    """frames x channels -> 1d float32. no copy for float32 mono input"""
+    if block.ndim > 1:
+        block = block[:, 0] if block.shape[1] == 1 else block.mean(axis=1)
+    return np.ascontiguousarray(block, dtype=np.float32)
+
+
+class StreamingResampler:
+    """
+    block by block resampling. filter state is carried between blocks, so there are no edge artifacts
+    at block boundaries (output equals resampling the whole stream at once).
+    """
+
+    def __init__(self, orig_sr: int, target_sr: int, quality='HQ'):
+        self.orig_sr = orig_sr
+        self.target_sr = target_sr
+        self._stream = None
+        if orig_sr != target_sr:
+            self._stream = soxr.ResampleStream(orig_sr, target_sr, 1, dtype='float32', quality=quality)
+
+    def process(self, block: np.ndarray, last=False) -> np.ndarray:
+        """block: 1d, or frames x channels (downmixed). last: flush the filter"""
+        mono = to_mono(block)
+        if self._stream is None:
+            return mono
+        return self._stream.resample_chunk(mono, last=last)
+
+
+def resample(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """one shot, 1d float32 output"""
+    mono = to_mono(audio)
+    if orig_sr == target_sr:
+        return mono
+    return soxr.resample(mono, orig_sr, target_sr)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from src.metrics import metrics
+from src.settings import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path, chunk_size=1024 ** 2) -> str:
+    """sha256 of file content"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    json results on disk, keyed by a hash of the inputs (audio content hash, model, language, range...).
+    least recently used entries are removed when the cache is over max_bytes.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(**parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            value = json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            metrics.inc('result_cache_requests_total', result='miss')
+            return None
+
+        os.utime(path)  # recently used
+        metrics.inc('result_cache_requests_total', result='hit')
+        return value
+
+    def put(self, key: str, value):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(value))
+        os.replace(tmp_path, path)  # readers never see a partial file
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for path in self.cache_dir.glob('*.json'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                logger.debug(f"evicted '{path.name}'")
+
+
+result_cache = ResultCache()
@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    single producer / single consumer float32 ring buffer (mono).
+
+    samples are written twice (at i and i + capacity), so any window of up to `capacity` samples
+    is a contiguous view of the underlying array - reading never copies.
+    the producer (audio callback) never blocks: if the reader falls behind, incoming samples are dropped
+    and counted in `overflow_samples`.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buf = np.zeros(2 * capacity, dtype=np.float32)
+        # monotonic counters, only written by one side each
+        self._write_pos = 0
+        self._read_pos = 0
+        self._cond = threading.Condition()
+
+        # stats
+        self.overflow_samples = 0
+        self.overflow_count = 0
+        self.underrun_count = 0
+
+    def available(self) -> int:
+        return self._write_pos - self._read_pos
+
+    def write(self, data: np.ndarray) -> int:
+        """called from the audio thread. mono samples (1d), or frames x channels (downmixed). returns samples written"""
+        if data.ndim > 1:
+            data = data[:, 0] if data.shape[1] == 1 else data.mean(axis=1)
+
+        free = self.capacity - self.available()
+        n = len(data)
+        if n > free:
+            self.overflow_samples += n - free
+            self.overflow_count += 1
+            n = free
+        if n == 0:
+            return 0
+
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        # primary copy
+        self._buf[start:start + first] = data[:first]
+        self._buf[:n - first] = data[first:n]
+        # mirror copy
+        self._buf[start + self.capacity:start + self.capacity + first] = data[:first]
+        self._buf[self.capacity:self.capacity + n - first] = data[first:n]
+
+        with self._cond:
+            self._write_pos += n
+            self._cond.notify()
+        return n
+
+    def peek(self, n: int, timeout: float = None) -> np.ndarray | None:
+        """
+        block until n samples are available, return them as a view (not consumed, don't modify).
+        the view stays valid until `consume` frees that region.
+        returns None on timeout (counted as underrun).
+        """
+        if n > self.capacity:
+            raise ValueError(f"window larger than buffer: {n} > {self.capacity}")
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.available() >= n, timeout=timeout):
+                self.underrun_count += 1
+                return None
+
+        start = self._read_pos % self.capacity
+        return self._buf[start:start + n]
+
+    def consume(self, n: int):
+        """release n samples back to the producer"""
+        n = min(n, self.available())
+        with self._cond:
+            self._read_pos += n
+
+    def stats(self) -> dict:
+        return {
+            'available': self.available(),
+            'capacity': self.capacity,
+            'overflow_samples': self.overflow_samples,
+            'overflow_count': self.overflow_count,
+            'underrun_count': self.underrun_count,
+        }
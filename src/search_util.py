@@ -0,0 +1,69 @@
+import base64
+import html
+import json
+import re
+
+SNIPPET_CHARS = 200
+SNIPPET_CONTEXT_CHARS = 60  # before the first match
+
+
+def query_terms(query: str) -> list[str]:
+    """lowercase words of a text search query (negated '-word' terms excluded)"""
+    words = re.findall(r'-?[\w\']+', query.lower())
+    return list(dict.fromkeys(word for word in words if not word.startswith('-')))
+
+
+def highlight(snippet: str, terms: list[str], truncated_start=False, truncated_end=False) -> str:
+    """html escaped snippet, terms wrapped in <mark>"""
+    if terms:
+        pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+        parts = []
+        pos = 0
+        for m in pattern.finditer(snippet):
+            parts.append(html.escape(snippet[pos:m.start()]))
+            parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+            pos = m.end()
+        parts.append(html.escape(snippet[pos:]))
+        text = ''.join(parts)
+    else:
+        text = html.escape(snippet)
+    return f"{'…' if truncated_start else ''}{text}{'…' if truncated_end else ''}"
+
+
+def make_snippet(text: str, terms: list[str], length: int = None) -> str | None:
+    """
+    highlighted SNIPPET_CHARS window of text around the first occurrence of any term, None if none occurs.
+    length: of the whole text text is the start of (truncation mark), default len(text)
+    """
+    lower = text.lower()
+    positions = [pos for pos in (lower.find(term) for term in terms) if pos >= 0]
+    if not positions:
+        return None
+    start = max(0, min(positions) - SNIPPET_CONTEXT_CHARS)
+    return highlight(text[start:start + SNIPPET_CHARS], terms, truncated_start=start > 0,
+                     truncated_end=start + SNIPPET_CHARS < (length or len(text)))
+
+
+def result_snippet(head: str, terms: list[str], length: int, segments: list[dict]) -> str:
+    """
+    search result snippet: around a match in the indexed head of the text, else in the best matching segment
+    (the match is further in), else the start of the text
+    """
+    for text, text_length in [(head, length), *((segment['text'], None) for segment in segments)]:
+        snippet = make_snippet(text, terms, text_length)
+        if snippet is not None:
+            return snippet
+    return highlight(head[:SNIPPET_CHARS], terms, truncated_end=SNIPPET_CHARS < length)
+
+
+def encode_cursor(score: float, doc_id: str) -> str:
+    """opaque pagination cursor: position after (score, id) in (score desc, id asc) order"""
+    return base64.urlsafe_b64encode(json.dumps([score, doc_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        score, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), str(doc_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
@@ -7,9 +7,38 @@ UPLOAD_DIR = './uploads'
 Path(UPLOAD_DIR).mkdir(exist_ok=True)
 Path(TEMP_FILES_DIR).mkdir(exist_ok=True)
 
+# transcription results cache
+RESULT_CACHE_DIR = f'{TEMP_FILES_DIR}/cache'
+RESULT_CACHE_MAX_BYTES = 500 * 1024 ** 2
+
 # devices
 LOOPBACK_DEVICE_ID = 16
 MIC_DEVICE_ID = 1
 
 # db
+DB_BACKEND = 'mongo'  # 'mongo', or 'sqlite' (embedded, no server needed)
 CONN_STRING = "mongodb://localhost:27017/"
+SQLITE_PATH = f'{TEMP_FILES_DIR}/transcripts.db'
+DB_POOL_SIZE = 10  # mongo connections
+BULK_MAX_ITEMS = 1000  # transcripts per bulk ingest request
+# stored transcript bodies: zlib compressed, large ones outside the document (GridFS / BLOB_DIR for sqlite)
+COMPRESSION_LEVEL = 6
+OFFLOAD_MIN_BYTES = 1024 ** 2  # compressed size
+BLOB_DIR = f'{TEMP_FILES_DIR}/blobs'
+SEARCH_TEXT_HEAD_CHARS = 4000  # indexed: this much text (snippets come from it) + the distinct words of the rest
+
+# models
+MODEL_CACHE_MAX_MODELS = 3  # e.g. 2 whisper models + diarization pipeline
+MODEL_CACHE_MAX_BYTES = 4 * 1024 ** 3
+WARMUP_MODELS = []  # loaded at app startup, e.g. ["small.en"]
+
+# jobs
+JOB_WORKERS = 4  # downloads etc. run concurrently
+MAX_QUEUED_JOBS = 32
+JOB_HISTORY = 100  # finished jobs kept for status/result requests
+# jobs transcribing at once per device. jobs share one model per device, and a model runs one call at a time
+# (whisper keeps per call state in the model, see ModelRegistry.exclusive): above 1 only helps with several models
+DEVICE_CONCURRENCY = {'cuda': 1, 'cpu': 1}
+
+# metrics
+TIMING_HEADERS = True  # Server-Timing header (per stage durations) on responses
@@ -1,13 +1,19 @@
 import json
 import logging
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import torch
-import whisper
 from pyannote.audio import Pipeline
 
-from src.audio_util import AudioEditor, to_str_hhmmss
+from src.audio_util import load_audio_range, to_ms
+from src.diarization_merge import merge_transcript, format_utterances
+from src.model_registry import DEFAULT_DEVICE, get_whisper_model, registry
+from src.result_cache import result_cache, file_hash
+from src.settings import TEMP_FILES_DIR
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,85 +28,104 @@ except ImportError:
 if not HUGGINGFACE_TOKEN:
     raise ValueError("Hugging Face token not found")
 
-# device
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-model = whisper.load_model("small").to(device)
+# device, models (loaded on first use)
+device = DEFAULT_DEVICE
+model_name = "small"
+PIPELINE_NAME = "pyannote/speaker-diarization-3.1"
 logger.info(f"device: {device}")
 
 # conf
 TIMESTAMP_FREQ_SEC = 60 * 5
+SAMPLE_RATE = 16000  # shared buffer for whisper and pyannote
+MEMMAP_MIN_FILE_BYTES = 20 * 1024 ** 2  # larger inputs are decoded to a memory-mapped file
 
 
-def transcribe_and_diarize(filename: str, end_time_str=None, num_speakers=None):
-    """
-    end_time_str format example: '10:30'.
-    """
-    logger.info(f"file: '{filename}'")
-
-    # file exists
-    if not Path(filename).is_file():
-        raise FileNotFoundError(f"file '{filename}' not found")
-
-    # trim audio
-    if end_time_str:
-        filename = AudioEditor.audio_segment(filename, end_time_str=end_time_str)
-
-    # transcribe
-    result_file = f"./temp/t_result_{Path(filename).stem}.txt"
-    if not Path(result_file).exists():
-        logger.info(f"transcribing '{filename}'...")
-        result = model.transcribe(filename)
-        Path(result_file).write_text(json.dumps(result))
-    else:
-        logger.info(f"loaded transcribe result from file '{result_file}'...")
+def get_pipeline():
+    """diarization pipeline, loaded once and kept in the model registry"""
 
-    result = Path(result_file).read_text()
-    result = json.loads(result)
+    def load():
+        pipeline = Pipeline.from_pretrained(PIPELINE_NAME, use_auth_token=HUGGINGFACE_TOKEN)
+        pipeline.to(torch.device(device))
+        return pipeline
 
-    # diarization
-    logger.info(f"speaker-diarization for '{filename}'...")
-    pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=HUGGINGFACE_TOKEN)
-    pipeline.to(torch.device(device))
-    diarization = pipeline(filename, num_speakers=num_speakers)
+    return registry.get(('pyannote', PIPELINE_NAME, device), load)
 
-    transcription = []
-    timestamp_iter_num = 1
 
-    itertracks = diarization.itertracks(yield_label=True)
-    turn, _, speaker = next(itertracks)
-    current_speaker = None
+def transcribe(audio: np.ndarray) -> dict:
+    logger.info(f"transcribing {len(audio) / SAMPLE_RATE:.0f} s...")
+    model = get_whisper_model(model_name)
+    with registry.exclusive(model):
+        return model.transcribe(audio, word_timestamps=True)
 
-    for segment in result['segments']:
-        seg_start_time = segment['start']
-        # seg_end_time = segment['end']
-        text = segment['text']
 
-        while turn and (turn.end < seg_start_time + 0.05):
-            turn, _, speaker = next(itertracks, (None, None, None))
+def diarize(audio: np.ndarray, num_speakers=None) -> list[list]:
+    """speaker turns [start, end, speaker]"""
+    logger.info(f"speaker-diarization {len(audio) / SAMPLE_RATE:.0f} s...")
+    waveform = torch.from_numpy(audio)[None]  # (channel, time), no copy
+    diarization = get_pipeline()({'waveform': waveform, 'sample_rate': SAMPLE_RATE}, num_speakers=num_speakers)
+    return [[turn.start, turn.end, speaker] for turn, _, speaker in diarization.itertracks(yield_label=True)]
 
-        if speaker != current_speaker:
-            transcription.append("\n")
-            current_speaker = speaker
 
-            if seg_start_time > (timestamp_iter_num * TIMESTAMP_FREQ_SEC):
-                timestamp_iter_num += 1
-                transcription.append(f"\n{to_str_hhmmss(seg_start_time)}\n\n")
-
-            transcription.append(f"{speaker}: ")
+def transcribe_and_diarize(filename: str, end_time_str=None, num_speakers=None):
+    """
+    end_time_str format example: '10:30'.
+    the file is decoded once, transcription and diarization run concurrently on the same buffer.
+    """
+    logger.info(f"file: '{filename}'")
 
-        transcription.append(text)
+    # file exists
+    if not Path(filename).is_file():
+        raise FileNotFoundError(f"file '{filename}' not found")
 
-    final_transcription = ''.join(transcription[1:])  # first line is empty
+    # cached by the original audio content and range
+    audio_hash = file_hash(filename)
+    end_ms = to_ms(end_time_str) if end_time_str else None
+    transcribe_key = result_cache.key(audio=audio_hash, model=model_name, lang=None, start_ms=0, end_ms=end_ms,
+                                      words=True)
+    diarize_key = result_cache.key(audio=audio_hash, pipeline=PIPELINE_NAME, start_ms=0, end_ms=end_ms,
+                                   num_speakers=num_speakers)
+    result = result_cache.get(transcribe_key)
+    turns = result_cache.get(diarize_key)
+    logger.info(f"cached: transcription {result is not None}, diarization {turns is not None}")
+
+    if result is None or turns is None:
+        # decode once (only up to end_time), long audio memory-mapped
+        mmap_file = None
+        if Path(filename).stat().st_size > MEMMAP_MIN_FILE_BYTES:
+            # unique per run: concurrent runs on the same file must not share (or delete) it
+            with tempfile.NamedTemporaryFile(dir=TEMP_FILES_DIR, prefix='sd_', suffix='.f32', delete=False) as f:
+                mmap_file = f.name
+
+        audio = None
+        try:
+            audio = load_audio_range(filename, end_sec=end_ms / 1000 if end_ms else None, sr=SAMPLE_RATE,
+                                     out_file=mmap_file)
+            with ThreadPoolExecutor(2) as executor:
+                transcribe_future = executor.submit(transcribe, audio) if result is None else None
+                diarize_future = executor.submit(diarize, audio, num_speakers) if turns is None else None
+
+                if transcribe_future:
+                    result = transcribe_future.result()
+                    result_cache.put(transcribe_key, result)
+                if diarize_future:
+                    turns = diarize_future.result()
+                    result_cache.put(diarize_key, turns)
+        finally:
+            del audio
+            if mmap_file:
+                os.remove(mmap_file)
+
+    # speaker per word (max overlap with speaker turns)
+    utterances = merge_transcript(result['segments'], turns)
+    final_transcription = format_utterances(utterances, TIMESTAMP_FREQ_SEC)
 
     prefix = "sd_"
-    out_filename = f"{prefix}{Path(filename).stem}.txt"
+    suffix = f"_0-{end_time_str.replace(':', '-')}" if end_time_str else ''
+    out_filename = f"{prefix}{Path(filename).stem}{suffix}.txt"
     Path(out_filename).write_text(final_transcription)
+    Path(out_filename).with_suffix('.json').write_text(json.dumps(utterances, indent=1))
 
-    logger.info(f"file saved as '{out_filename}'")
-
-    # rm segmented file
-    if end_time_str:
-        os.remove(filename)
+    logger.info(f"file saved as '{out_filename}' (structured: .json)")
 
     return out_filename
 
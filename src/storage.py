@@ -0,0 +1,152 @@
+"""
+transcript storage backend, chosen by settings.DB_BACKEND.
+
+backends are modules with the same functions (documented here, backends only add how they do it):
+- init(): connect, create the schema and indexes. called once, by load_backend
+- save_transcript(doc, segments=None) -> id. segments: [{'start', 'end', 'text', 'speaker' (optional)}], seconds
+- save_transcripts(items, ordered=False) -> a result per item. bulk ingest of transcript docs
+  (title, content, src_type, channel, source_id, optional 'segments'), keyed by (source_id, content_hash):
+  an item already stored is not written again. ordered: stop at the first failed item (the rest are 'skipped').
+  result: {'index', 'status': 'inserted' | 'exists' | 'error' | 'skipped', 'id', 'error'}
+- get_transcript(id) -> doc or None. get_version(id) -> version or None, the content isn't loaded
+- search_transcripts(query, limit=SEARCH_LIMIT, cursor=None) -> (results, next page cursor or None).
+  one page of matches, best first: id, title, src_type, score, a highlighted html snippet (no content),
+  and the best matching segments (SEARCH_SEGMENTS_PER_RESULT, with timestamps)
+- get_segments(id, start_sec=None, end_sec=None, limit=SEGMENTS_MAX_LIMIT) -> segments overlapping the range,
+  by time. the content isn't loaded
+- update_transcript(id, doc, segments=None, version=None), patch_transcript(id, edits, version=None)
+  -> the new version, None if not found. segments are replaced when given (otherwise kept)
+- migrate() -> number of transcripts converted
+
+transcripts have a version (1 on insert, +1 per update). updates given the version the client has
+fail with VersionConflict if the transcript changed since (optimistic concurrency).
+
+bodies are stored compressed, large ones offloaded (GridFS / blob files), with a small `search_text`
+(head of the text and the distinct words of the rest) kept in the document for the text index.
+mongo documents stored before that (plain `content`) are converted by `migrate`:
+
+python -m src.storage migrate
+"""
+import argparse
+import hashlib
+import importlib
+import logging
+import re
+import zlib
+
+from src.settings import DB_BACKEND, COMPRESSION_LEVEL, SEARCH_TEXT_HEAD_CHARS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKENDS = {
+    'mongo': 'src.db',
+    'sqlite': 'src.db_sqlite',
+}
+
+SEARCH_LIMIT = 15  # default page size
+SEARCH_MAX_LIMIT = 100
+SEARCH_SEGMENTS_PER_RESULT = 3  # matching segments returned per transcript
+SEGMENTS_MAX_LIMIT = 1000
+
+
+def load_backend(name=DB_BACKEND, init=True):
+    """imports the backend module, and initializes it (connection, indexes. may raise)"""
+    if name not in BACKENDS:
+        raise ValueError(f"unknown DB_BACKEND: '{name}', expecting one of {list(BACKENDS)}")
+    backend = importlib.import_module(BACKENDS[name])
+    if init:
+        backend.init()
+    return backend
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version: int):
+        super().__init__(f"transcript changed (current version: {current_version})")
+        self.current_version = current_version
+
+
+def content_hash(content: str) -> str:
+    """bulk ingest dedup key (with the source id)"""
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def compress(content: str) -> bytes:
+    return zlib.compress(content.encode(), COMPRESSION_LEVEL)
+
+
+def decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode()
+
+
+def make_search_text(content: str, head_chars=SEARCH_TEXT_HEAD_CHARS) -> str:
+    """
+    text to index: the first head_chars of the content, then the distinct words of the rest
+    (every word stays searchable, phrases and snippets only within the head)
+    """
+    if len(content) <= head_chars:
+        return content
+
+    head = content[:head_chars]
+    head_words = set(re.findall(r"[\w']+", head.lower()))
+    rest = dict.fromkeys(word for word in re.findall(r"[\w']+", content[head_chars:].lower()) if word not in head_words)
+    return f"{head}\n{' '.join(rest)}"
+
+
+def segment_out(segment) -> dict:
+    """stored segment (document or row) -> api segment, speaker only if set"""
+    out = {'start': segment['start'], 'end': segment['end'], 'text': segment['text']}
+    if 'speaker' in segment.keys() and segment['speaker']:
+        out['speaker'] = segment['speaker']
+    return out
+
+
+def max_segment_sec(segments: list[dict]) -> float:
+    """longest segment. stored with the transcript, bounds time range queries (a segment starting that much
+    before a window may overlap it). diarized segments can be minutes long"""
+    return max((segment['end'] - segment['start'] for segment in segments), default=0.0)
+
+
+def validate_edits(edits: list[dict]) -> list[dict]:
+    """
+    patch: [{'start', 'end', 'text'}], replace content[start:end] (code points, offsets in the current content).
+    returns the edits sorted last to first (applying them in this order keeps the other offsets valid).
+    ValueError if malformed or overlapping
+    """
+    if not isinstance(edits, list) or not edits:
+        raise ValueError("edits: expecting a non-empty list")
+
+    parsed = []
+    for edit in edits:
+        try:
+            start, end, text = int(edit['start']), int(edit['end']), str(edit.get('text', ''))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"invalid edit: {edit}")
+        if not 0 <= start <= end:
+            raise ValueError(f"invalid edit range: {edit}")
+        parsed.append({'start': start, 'end': end, 'text': text})
+
+    parsed.sort(key=lambda e: e['start'], reverse=True)
+    for later, earlier in zip(parsed, parsed[1:]):
+        if earlier['end'] > later['start']:
+            raise ValueError(f"overlapping edits: {earlier}, {later}")
+    return parsed
+
+
+def apply_edits(content: str, edits: list[dict]) -> str:
+    """edits from validate_edits. ValueError if an edit is out of range"""
+    for edit in edits:
+        if edit['end'] > len(content):
+            raise ValueError(f"edit out of range (content length {len(content)}): {edit}")
+        content = content[:edit['start']] + edit['text'] + content[edit['end']:]
+    return content
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="storage maintenance")
+    parser.add_argument('command', choices=['migrate'], help="migrate: compress bodies of documents stored before")
+    parser.add_argument('--backend', default=DB_BACKEND, choices=list(BACKENDS))
+    args = parser.parse_args()
+
+    backend = load_backend(args.backend)
+    logger.info(f"migrated {backend.migrate()} transcripts ({args.backend})")
@@ -1,131 +1,479 @@
 import logging
+import multiprocessing
 import os
-import queue
 import re
 import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
 from pathlib import Path
 
-import librosa
 import numpy as np
 import sounddevice as sd
 import torch
 import whisper
 
-from src.audio_util import DeviceUtil, AudioEditor, to_str_hhmmss
+from src.audio_util import DeviceUtil, AudioEditor, to_str_hhmmss, to_ms
+from src.metrics import metrics, timed
+from src.model_registry import DEFAULT_DEVICE, get_whisper_model, registry
+from src.resample import StreamingResampler
+from src.result_cache import result_cache, file_hash
+from src.ring_buffer import RingBuffer
 from src.settings import TEMP_FILES_DIR, LOOPBACK_DEVICE_ID
+from src.vad import has_speech, find_pause, dedup_overlap, split_at_pauses
 
 # config
 SAMPLE_RATE = 44100
 WHISPER_SAMPLE_RATE = 16000  # 16kHz
 WHISPER_CHANNELS = 1
 CHUNK_DURATION_SEC = 5  # x seconds at a time
+OVERLAP_SEC = 1  # windows cut without a pause overlap by this much (repeated text is removed)
+MIN_CHUNK_SEC = 2  # don't cut at a pause before this
+BUFFER_DURATION_SEC = 60  # capture backlog before blocks are dropped
+
+# long files on cpu: windows (cut at pauses) transcribed in parallel processes
+PARALLEL_MIN_SEC = 60 * 10
+PARALLEL_WINDOW_SEC = 60 * 3
+PARALLEL_THREADS_PER_WORKER = 2
+PARALLEL_WORKERS = max(1, (os.cpu_count() or 1) // PARALLEL_THREADS_PER_WORKER)
+
+# streaming: segments are sent window by window
+STREAM_WINDOW_SEC = 30
+STREAM_PROMPT_CHARS = 200  # previous window's text, passed as prompt
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
 
 LANG = 'en'
 model_name = "small.en"  # sometimes small is better than small.en
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-model = whisper.load_model(model_name).to(device)
-logger.info(f"model: {model_name}, device: {device}")
-
-audio_queue = queue.Queue()
-transcription_queue = queue.Queue()
-devices = DeviceUtil.list_audio_devices()
 
 
-def transcribe_audio():
-    """transcribe audio chunks from queue"""
+def get_model():
+    """loaded on first use, shared via the model registry"""
+    return get_whisper_model(model_name)
+
+
+devices = None  # input devices, queried on first real-time use (not in worker processes)
+LATENCY_HISTORY = 1000  # latencies kept per source for stats()
+
+
+def get_devices():
+    global devices
+    if devices is None:
+        devices = DeviceUtil.get_devices()
+    return devices
+
+
+class RealtimeSource:
+    """
+    one capture device of the real-time transcription: its buffer (resampled, mono), resampler,
+    and transcription state (position, previous text for overlap dedup). label: e.g. 'mic', 'loopback'
+    """
+
+    def __init__(self, label: str, device_id, native_rate=True):
+        self.label = label
+        self.device_id = device_id
+        self.buffer = RingBuffer(WHISPER_SAMPLE_RATE * BUFFER_DURATION_SEC)
+        if native_rate and DeviceUtil.supports_samplerate(device_id, WHISPER_SAMPLE_RATE, WHISPER_CHANNELS):
+            self.capture_rate = WHISPER_SAMPLE_RATE
+        else:
+            self.capture_rate = SAMPLE_RATE
+        self.resampler = StreamingResampler(self.capture_rate, WHISPER_SAMPLE_RATE)
+
+        self.position = 0  # samples consumed
+        self.prev_text = ''
+        self.skipped = 0
+        self.overflow_count = 0
+        self.latencies = deque(maxlen=LATENCY_HISTORY)  # seconds, capture of a window's end -> its text
+
+    def open_stream(self, data_ready: threading.Event) -> sd.InputStream:
+        def audio_callback(indata, frames, time, status):
+            if status:
+                print(status)
+                metrics.inc('realtime_input_status_total', status=str(status).strip(), source=self.label)
+            self.buffer.write(self.resampler.process(indata))
+            data_ready.set()
+
+        device = get_devices()[self.device_id]
+        logger.info(f"[{self.label}] using device [{self.device_id}]: {device['name']}, "
+                    f"{device['max_input_channels']} channels, "
+                    f"{device['default_samplerate']} Hz, capturing at {self.capture_rate} Hz")
+        return sd.InputStream(samplerate=self.capture_rate, channels=WHISPER_CHANNELS, dtype='float32',
+                              device=self.device_id, callback=audio_callback)
+
+    def stats(self) -> dict:
+        latencies = np.array(self.latencies) * 1000
+        stats = {'source': self.label, 'buffer': self.buffer.stats(), 'skipped_windows': self.skipped}
+        if len(latencies):
+            stats['latency_ms'] = {'p50': float(np.percentile(latencies, 50)),
+                                   'p90': float(np.percentile(latencies, 90)), 'max': float(latencies.max())}
+        return stats
+
+
+active_sources: list[RealtimeSource] = []  # while recording
+
+
+def _per_source(fn):
+    """labelled gauge: fn(source) for each active source"""
+    return lambda: {(('source', source.label),): fn(source) for source in active_sources}
+
+
+# real-time recorder state, read when /metrics is collected
+metrics.gauge_fn('realtime_buffer_samples', _per_source(lambda source: source.buffer.available()))
+metrics.gauge_fn('realtime_dropped_samples', _per_source(lambda source: source.buffer.overflow_samples))
+metrics.gauge_fn('realtime_dropped_blocks', _per_source(lambda source: source.buffer.overflow_count))
+metrics.gauge_fn('realtime_underruns', _per_source(lambda source: source.buffer.underrun_count))
+metrics.describe('realtime_buffer_samples', "samples waiting in the real-time buffer (queue depth)")
+metrics.describe('realtime_dropped_blocks', "capture blocks (partly) dropped because the buffer was full")
+metrics.describe('realtime_latency_seconds', "capture of a window's last sample -> its text, per source")
+
+
+def transcribe_window(model, source: RealtimeSource, window: np.ndarray, overlap_sec=OVERLAP_SEC, on_text=None):
+    """
+    transcribe the next window of a source, window: its buffer view (CHUNK_DURATION_SEC).
+    silent windows are skipped, chunks are cut at pauses when possible, otherwise windows overlap.
+    on_text: optional callback(text, end_sample, label), end_sample: chunk end in the source's stream (16kHz samples)
+    """
+    chunk_size = len(window)
+    overlap_size = int(WHISPER_SAMPLE_RATE * overlap_sec)
+    min_chunk_size = WHISPER_SAMPLE_RATE * MIN_CHUNK_SEC
+    if overlap_size >= chunk_size:
+        raise ValueError(f"overlap_sec ({overlap_sec}) must be shorter than the window ({chunk_size} samples)")
+
+    # silence: skip inference, keep the tail in case speech starts there
+    if not has_speech(window, WHISPER_SAMPLE_RATE):
+        source.buffer.consume(chunk_size - overlap_size)
+        source.position += chunk_size - overlap_size
+        source.prev_text = ''
+        source.skipped += 1
+        metrics.inc('realtime_windows_total', result='silent', source=source.label)
+        logger.debug(f"[{source.label}] skipped silent window ({source.skipped} so far)")
+        return
+
+    cut = find_pause(window, WHISPER_SAMPLE_RATE, min_pos=min_chunk_size)
+    if cut is not None:
+        chunk, advance, overlapping = window[:cut], cut, False
+    else:
+        chunk, advance, overlapping = window, chunk_size - overlap_size, overlap_size > 0
+
+    # transcribe (reads the buffer view, released only after)
+    with registry.exclusive(model), timed('realtime_inference'):
+        result = model.transcribe(chunk, language=LANG)
+    end_sample = source.position + len(chunk)
+    # audio captured since the chunk's end, i.e. how far behind capture the text is
+    latency = (source.position + source.buffer.available() - end_sample) / WHISPER_SAMPLE_RATE
+    source.buffer.consume(advance)
+    source.position += advance
+    source.latencies.append(latency)
+    metrics.observe('realtime_latency_seconds', latency, source=source.label)
+    metrics.inc('realtime_windows_total', result='transcribed', source=source.label)
+
+    if isinstance(result, tuple):
+        segments, info = result
+        text = ''.join(segment.text for segment in segments)
+    else:
+        text = result['text']
+
+    printed = dedup_overlap(source.prev_text, text) if source.prev_text else text.strip()
+    if printed:
+        print(f"[{source.label}] {printed}" if len(active_sources) > 1 else printed)
+        if on_text:
+            on_text(printed, end_sample, source.label)
+    source.prev_text = text if overlapping else ''
+
+    if source.buffer.overflow_count > source.overflow_count:
+        source.overflow_count = source.buffer.overflow_count
+        logger.warning(f"[{source.label}] transcription falling behind capture: {source.buffer.stats()}")
+
+
+def transcribe_audio(sources: list[RealtimeSource], data_ready: threading.Event, stop: threading.Event,
+                     overlap_sec=OVERLAP_SEC, on_text=None):
+    """
+    one inference worker (one model) for all sources: a window of each source with a full one, in turn
+    (round robin, so a busy source can't starve the others). runs until stop is set
+    """
+    model = get_model()
     print(f"Transcription: ")
+    chunk_size = WHISPER_SAMPLE_RATE * CHUNK_DURATION_SEC
+
+    while not stop.is_set():
+        data_ready.clear()
+        ready = [source for source in sources if source.buffer.available() >= chunk_size]
+        if not ready:
+            if not data_ready.wait(timeout=CHUNK_DURATION_SEC * 2):
+                for source in sources:
+                    source.buffer.underrun_count += 1  # no input from any source
+            continue
+
+        for source in ready:
+            transcribe_window(model, source, source.buffer.peek(chunk_size), overlap_sec, on_text)
+
+
+def record_and_transcribe_multi(duration, device_ids: dict, overlap_sec=OVERLAP_SEC, native_rate=True,
+                                on_text=None) -> list[dict]:
+    """
+    real time, several devices at once (e.g. {'mic': MIC_DEVICE_ID, 'loopback': LOOPBACK_DEVICE_ID}),
+    text labelled by source. one model and inference thread shared by all sources, new buffers per call.
+    on_text: optional callback(text, end_sample, label). returns stats per source (buffer, latency)
+    """
+    if overlap_sec >= CHUNK_DURATION_SEC:  # windows wouldn't advance
+        raise ValueError(f"overlap_sec ({overlap_sec}) must be shorter than CHUNK_DURATION_SEC ({CHUNK_DURATION_SEC})")
+    sources = [RealtimeSource(label, device_id, native_rate) for label, device_id in device_ids.items()]
+    data_ready, stop = threading.Event(), threading.Event()
+    active_sources[:] = sources
+
+    # transcription thread
+    transcribe_thread = threading.Thread(target=transcribe_audio,
+                                         args=(sources, data_ready, stop, overlap_sec, on_text), daemon=True)
+    try:
+        transcribe_thread.start()
+        logger.debug("transcription thread started")
 
-    while True:
-        audio_data = []
-        while len(audio_data) < SAMPLE_RATE * CHUNK_DURATION_SEC:
-            if not audio_queue.empty():
-                audio_data.extend(audio_queue.get())
+        # record
+        with ExitStack() as stack:
+            for source in sources:
+                stack.enter_context(source.open_stream(data_ready))
+            logger.info(f"recording and transcribing {list(device_ids)} for {duration} seconds...")
+            sd.sleep(int(duration * 1000))
+    except Exception as e:
+        logger.info(f"audio devices list:\n{DeviceUtil.list_audio_devices()}")
+        logger.error(e)
+    finally:
+        stop.set()
+        data_ready.set()
+        if transcribe_thread.is_alive():
+            transcribe_thread.join()  # the buffers have a single consumer: done before they're dropped
+        active_sources.clear()
 
-        if len(audio_data) > 0:
-            audio_np = np.array(audio_data)
+    stats = [source.stats() for source in sources]
+    logger.info(f"stats: {stats}")
+    return stats
 
-            # convert to mono channel, resample
-            audio_mono = np.mean(audio_np, axis=1)
-            audio_resampled = librosa.resample(audio_mono, orig_sr=SAMPLE_RATE, target_sr=WHISPER_SAMPLE_RATE)
 
-            # transcribe
-            result = model.transcribe(audio_resampled, language=LANG)
+def record_and_transcribe_real_time(duration, device_id, overlap_sec=OVERLAP_SEC, native_rate=True, on_text=None):
+    """
+    real time (less accurate)
+    native_rate: capture at WHISPER_SAMPLE_RATE if the device supports it (no resampling)
+    on_text: optional callback(text, end_sample), end_sample: chunk end in the stream (16kHz samples)
+    """
+    on_source_text = (lambda text, end_sample, label: on_text(text, end_sample)) if on_text else None
+    return record_and_transcribe_multi(duration, {'default': device_id}, overlap_sec, native_rate, on_source_text)[0]
 
-            if isinstance(result, tuple):
-                segments, info = result
-                for segment in segments:
-                    print(f"{segment.text}")
-            else:
-                print(result['text'])
 
+###########
 
-def record_and_transcribe_real_time(duration, device_id):
-    """real time (less accurate)"""
+_pool = None
 
-    def audio_callback(indata, frames, time, status):
-        if status:
-            print(status)
-        audio_queue.put(indata.copy())
 
-    logger.info(f"using device [{device_id}]: {devices[device_id]['name']}, "
-                f"{devices[device_id]['max_input_channels']} channels, "
-                f"{devices[device_id]['default_samplerate']} Hz")
+def _init_worker(num_threads, name):
+    global model_name
+    torch.set_num_threads(num_threads)
+    model_name = name
 
-    try:
-        # transcription thread
-        transcribe_thread = threading.Thread(target=transcribe_audio, daemon=True)
-        transcribe_thread.start()
-        logger.debug("transcription thread started")
 
-        # record
-        with sd.InputStream(samplerate=SAMPLE_RATE, channels=WHISPER_CHANNELS,
-                            device=device_id, callback=audio_callback):
-            logger.info(f"recording and transcribing for {duration} seconds...")
-            sd.sleep(int(duration * 1000))
-    except Exception as e:
-        logger.info(f"audio devices list:\n{DeviceUtil.list_audio_devices()}")
-        logger.error(e)
+def _transcribe_window(audio: np.ndarray) -> dict:
+    """runs in a worker process (model loaded once per process)"""
+    return get_model().transcribe(audio, language=LANG)
 
 
-###########
+def get_pool(workers=PARALLEL_WORKERS) -> ProcessPoolExecutor:
+    """process pool kept for reuse, so workers load the model once"""
+    global _pool
+    if _pool is None:
+        # spawn: forking a process with running threads (flask, jobs) is unsafe
+        _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=_init_worker, initargs=(PARALLEL_THREADS_PER_WORKER, model_name))
+    return _pool
 
-def transcribe_file(audio_file, show_timestamps=False):
-    logger.info(f"transcribing '{audio_file}'...")
-    result = model.transcribe(audio_file, language=LANG, verbose=True if logger.level == logging.DEBUG else False)
 
-    result_str = result["text"]
-    if show_timestamps:
+def stitch_results(results: list[dict], offsets_sec: list[float]) -> dict:
+    """merge results of consecutive windows, shifting timestamps to the whole file"""
+    segments = []
+    for result, offset in zip(results, offsets_sec):
+        for segment in result['segments']:
+            segment = dict(segment, id=len(segments), start=segment['start'] + offset, end=segment['end'] + offset)
+            if segment.get('words'):
+                segment['words'] = [dict(w, start=w['start'] + offset, end=w['end'] + offset)
+                                    for w in segment['words']]
+            segments.append(segment)
+
+    return {'text': ''.join(result['text'] for result in results), 'segments': segments,
+            'language': results[0]['language'] if results else LANG}
+
+
+def transcribe_parallel(audio: np.ndarray, workers=PARALLEL_WORKERS, progress=None) -> dict:
+    """audio: 16kHz float32. progress: optional callback(fraction done)"""
+    windows = split_at_pauses(audio, WHISPER_SAMPLE_RATE, PARALLEL_WINDOW_SEC)
+    logger.info(f"transcribing {len(windows)} windows, {workers} processes...")
+
+    pool = get_pool(workers)
+    futures = [pool.submit(_transcribe_window, audio[start:end]) for start, end in windows]
+    for i, _ in enumerate(as_completed(futures)):
+        if progress:
+            progress((i + 1) / len(futures))
+
+    results = [future.result() for future in futures]
+    return stitch_results(results, [start / WHISPER_SAMPLE_RATE for start, _ in windows])
+
+
+def use_parallel(audio: np.ndarray) -> bool:
+    return (DEFAULT_DEVICE == 'cpu' and PARALLEL_WORKERS > 1
+            and len(audio) > PARALLEL_MIN_SEC * WHISPER_SAMPLE_RATE)
+
+
+def transcribe_audio_data(audio: np.ndarray, progress=None) -> dict:
+    """whisper result dict (text, segments, language) for 16kHz float32 audio"""
+    metrics.inc('transcribed_audio_seconds_total', len(audio) / WHISPER_SAMPLE_RATE)
+    if use_parallel(audio):
+        with timed('inference_parallel'):
+            return transcribe_parallel(audio, progress=progress)
+
+    model = get_model()
+    with registry.exclusive(model), timed('inference'):
+        result = model.transcribe(audio, language=LANG, verbose=True if logger.level == logging.DEBUG else False)
+    if progress:
+        progress(1.0)
+    return result
+
+
+def format_segment(segment: dict, show_timestamps=False) -> str:
+    if not show_timestamps:
+        return segment['text']
+    return f"{to_str_hhmmss(segment['start'])} - {to_str_hhmmss(segment['end'])}: {segment['text']}"
+
+
+def format_result(result: dict, show_timestamps=False) -> str:
+    if not show_timestamps:
+        return result["text"]
+
+    res_list = [format_segment(segment, show_timestamps) for segment in result["segments"]]
+    return "\n".join(res_list)
 
-        res_list = []
-        for segment in result["segments"]:
-            line = f"{to_str_hhmmss(segment['start'])} - {to_str_hhmmss(segment['end'])}: {segment['text']}"
-            res_list.append(line)
-        result_str = "\n".join(res_list)
 
-    out_file = f"{TEMP_FILES_DIR}/t_{Path(audio_file).stem}.txt"
-    out_file = re.sub(r'[<>!^&*@#$+`]', '', out_file)
-    out_file = re.sub(r'[:：]', '_', out_file)
+def result_key(audio_hash: str, start_ms=0, end_ms=None) -> str:
+    """result cache key (audio content hash, model, language, range)"""
+    return result_cache.key(audio=audio_hash, model=model_name, lang=LANG, start_ms=start_ms, end_ms=end_ms)
+
+
+def _cache_key(audio_file, start_time_str=None, end_time_str=None) -> str:
+    start_ms = to_ms(start_time_str) if start_time_str else 0
+    end_ms = to_ms(end_time_str) if end_time_str else None
+    return result_key(file_hash(audio_file), start_ms, end_ms)
+
+
+def _load_audio(audio_file, start_time_str=None, end_time_str=None) -> np.ndarray:
+    """decoded once (16kHz mono float32), only the requested range"""
+    with timed('decode'):
+        if start_time_str or end_time_str:
+            return AudioEditor.load_segment(audio_file, start_time_str, end_time_str, sr=WHISPER_SAMPLE_RATE)
+        return whisper.load_audio(audio_file)
+
+
+def transcribe_cached(audio_file, start_time_str=None, end_time_str=None, progress=None) -> dict:
+    """whisper result for the file (or a time range of it), cached by audio content, model, language and range"""
+    with timed('hash'):
+        key = _cache_key(audio_file, start_time_str, end_time_str)
+
+    result = result_cache.get(key)
+    if result is not None:
+        logger.info(f"loaded result from cache for '{audio_file}' ({start_time_str}-{end_time_str})")
+        if progress:
+            progress(1.0)
+        return result
+
+    audio = _load_audio(audio_file, start_time_str, end_time_str)
+    result = transcribe_audio_data(audio, progress=progress)
+    result_cache.put(key, result)
+    return result
+
+
+def stream_transcription(audio_file, start_time_str=None, end_time_str=None, progress=None):
+    """
+    yields segments as soon as they are decoded (STREAM_WINDOW_SEC windows, cut at pauses),
+    timestamps relative to the whole range. the complete result is cached at the end.
+    long audio on cpu: windows are transcribed in parallel processes, yielded in order.
+    progress: optional callback(fraction done)
+    """
+    with timed('hash'):
+        key = _cache_key(audio_file, start_time_str, end_time_str)
+    result = result_cache.get(key)
+    if result is not None:
+        logger.info(f"loaded result from cache for '{audio_file}' ({start_time_str}-{end_time_str})")
+        if progress:
+            progress(1.0)
+        yield from result['segments']
+        return
+
+    audio = _load_audio(audio_file, start_time_str, end_time_str)
+    windows = split_at_pauses(audio, WHISPER_SAMPLE_RATE, STREAM_WINDOW_SEC)
+    offsets = [start / WHISPER_SAMPLE_RATE for start, _ in windows]
+    parallel = use_parallel(audio)
+    logger.info(f"streaming '{audio_file}', {len(windows)} windows{' in parallel' if parallel else ''}...")
+
+    metrics.inc('transcribed_audio_seconds_total', len(audio) / WHISPER_SAMPLE_RATE)
+    window_results = _parallel_window_results(audio, windows) if parallel else _window_results(audio, windows)
+    results = []
+    num_segments = 0
+    for result, offset in zip(window_results, offsets):
+        results.append(result)
+        if progress:
+            progress(len(results) / len(windows))
+
+        for segment in stitch_results([result], [offset])['segments']:
+            segment['id'] = num_segments
+            num_segments += 1
+            yield segment
+
+    result_cache.put(key, stitch_results(results, offsets))
+
+
+def _window_results(audio: np.ndarray, windows: list[tuple]):
+    """whisper result per window, in this process. the previous window's text is the next one's prompt"""
+    model = get_model()
+    prompt = None
+    for start, end in windows:
+        with registry.exclusive(model), timed('inference'):
+            result = model.transcribe(audio[start:end], language=LANG, initial_prompt=prompt)
+        yield result
+        prompt = result['text'][-STREAM_PROMPT_CHARS:] or None
+
+
+def _parallel_window_results(audio: np.ndarray, windows: list[tuple]):
+    """whisper result per window, all submitted to the process pool, yielded in order"""
+    futures = [get_pool().submit(_transcribe_window, audio[start:end]) for start, end in windows]
+    for future in futures:
+        with timed('inference_parallel'):
+            result = future.result()
+        yield result
+
+
+def save_result(result: dict, name: str, show_timestamps=False, out_dir=TEMP_FILES_DIR) -> str:
+    result_str = format_result(result, show_timestamps)
+
+    name = re.sub(r'[<>!^&*@#$+`]', '', name)
+    name = re.sub(r'[:：]', '_', name)
+    out_file = f"{out_dir}/t_{name}.txt"
 
     Path(out_file).write_text(result_str)
     logger.info(f"saved as: '{out_file}'")
     return out_file
 
 
-def transcribe_file_segment(audio_file, start_time_str=None, end_time_str=None, show_timestamps=False):
+def transcribe_file(audio_file, show_timestamps=False, progress=None):
+    logger.info(f"transcribing '{audio_file}'...")
+    result = transcribe_cached(audio_file, progress=progress)
+    return save_result(result, Path(audio_file).stem, show_timestamps)
+
+
+def transcribe_file_segment(audio_file, start_time_str=None, end_time_str=None, show_timestamps=False, progress=None):
     if (not start_time_str) and (not end_time_str):
-        out_file = transcribe_file(audio_file, show_timestamps)
+        out_file = transcribe_file(audio_file, show_timestamps, progress=progress)
         return out_file
 
-    logger.debug(f"creating temp segment file...")
-    segment_file = AudioEditor.audio_segment(audio_file, start_time_str, end_time_str)
-    out_file = transcribe_file(segment_file, show_timestamps)
-
-    logger.debug(f"rm segment file '{segment_file}'")
-    os.remove(segment_file)
-    return out_file
+    logger.info(f"transcribing '{audio_file}' {start_time_str}-{end_time_str}...")
+    result = transcribe_cached(audio_file, start_time_str, end_time_str, progress=progress)
+    name = f"segment_{start_time_str or 0}_{end_time_str or 'end'}_{Path(audio_file).stem}"
+    return save_result(result, name, show_timestamps)
 
 
 if __name__ == "__main__":
@@ -133,5 +481,7 @@ if __name__ == "__main__":
 
     # Record and transcribe
     record_and_transcribe_real_time(60 * 2, device_id)
+    # calls: both sides, one model
+    # record_and_transcribe_multi(60 * 2, {'mic': MIC_DEVICE_ID, 'loopback': LOOPBACK_DEVICE_ID})
 
     # transcribe_file_segment(file, "8:00", "15:00")
@@ -0,0 +1,94 @@
+import re
+
+import numpy as np
+
+# energy / zero-crossing voice activity detection
+FRAME_MS = 30
+ENERGY_THRESHOLD = 0.01  # frame rms (float audio in [-1, 1])
+ZCR_UNVOICED = 0.25  # low energy frames with many zero crossings are likely fricatives ('s', 'f')
+MIN_SPEECH_SEC = 0.2
+MIN_PAUSE_SEC = 0.3
+DEDUP_MIN_WORDS = 2  # shorter repeats are likely genuine ('I ... I think')
+
+
+def frame_features(audio: np.ndarray, sr: int, frame_ms=FRAME_MS) -> tuple[np.ndarray, np.ndarray]:
+    """rms energy and zero crossing rate per frame (trailing partial frame is ignored)"""
+    frame_len = int(sr * frame_ms / 1000)
+    n_frames = len(audio) // frame_len
+    frames = audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+
+    rms = np.sqrt(np.einsum('ij,ij->i', frames, frames, dtype=np.float64) / frame_len)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_len
+    return rms, zcr
+
+
+def speech_frames(audio: np.ndarray, sr: int, energy_threshold=ENERGY_THRESHOLD, frame_ms=FRAME_MS) -> np.ndarray:
+    """bool per frame"""
+    rms, zcr = frame_features(audio, sr, frame_ms)
+    voiced = rms > energy_threshold
+    unvoiced = (rms > energy_threshold / 4) & (zcr > ZCR_UNVOICED)
+    return voiced | unvoiced
+
+
+def has_speech(audio: np.ndarray, sr: int, energy_threshold=ENERGY_THRESHOLD, min_speech_sec=MIN_SPEECH_SEC) -> bool:
+    is_speech = speech_frames(audio, sr, energy_threshold)
+    return np.count_nonzero(is_speech) * FRAME_MS / 1000 >= min_speech_sec
+
+
+def find_pause(audio: np.ndarray, sr: int, min_pos: int = 0, energy_threshold=ENERGY_THRESHOLD,
+               min_pause_sec=MIN_PAUSE_SEC) -> int | None:
+    """
+    sample index in the middle of the last pause (silence of at least min_pause_sec) after min_pos.
+    returns None if there is no such pause.
+    """
+    frame_len = int(sr * FRAME_MS / 1000)
+    silent = ~speech_frames(audio, sr, energy_threshold)
+    min_frames = max(1, int(min_pause_sec * 1000 / FRAME_MS))
+
+    # runs of silent frames: [start, end)
+    padded = np.concatenate(([False], silent, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = edges[::2], edges[1::2]
+
+    mids = (starts + ends) // 2 * frame_len
+    ok = ((ends - starts) >= min_frames) & (mids >= min_pos)
+    if not ok.any():
+        return None
+    return int(mids[ok][-1])
+
+
+def _norm_word(word: str) -> str:
+    return re.sub(r"[^\w']", '', word.lower())
+
+
+def dedup_overlap(prev_text: str, text: str, max_words=20, min_words=DEDUP_MIN_WORDS) -> str:
+    """drop the beginning of `text` that repeats the end of `prev_text` (overlapping windows), min_words or more"""
+    prev_words = [w for w in map(_norm_word, prev_text.split()) if w][-max_words:]
+    words = text.split()
+    norm = [_norm_word(w) for w in words]
+
+    for n in range(min(len(prev_words), len(words)), min_words - 1, -1):
+        if prev_words[-n:] == norm[:n]:
+            return ' '.join(words[n:])
+
+    return text
+
+
+def split_at_pauses(audio: np.ndarray, sr: int, window_sec: float, energy_threshold=ENERGY_THRESHOLD) -> list[tuple]:
+    """
+    (start, end) sample ranges of at most window_sec, cut at the last pause in the second half of each window
+    (hard cut if there's none)
+    """
+    window = int(window_sec * sr)
+    bounds = []
+    start = 0
+    while len(audio) - start > window:
+        cut = find_pause(audio[start:start + window], sr, min_pos=window // 2, energy_threshold=energy_threshold)
+        end = start + (cut if cut is not None else window)
+        bounds.append((start, end))
+        start = end
+
+    if start < len(audio):
+        bounds.append((start, len(audio)))
+    return bounds
@@ -8,7 +8,8 @@ from urllib.parse import parse_qs, urlparse
 
 import yt_dlp
 
-from src.audio_util import AudioEditor
+from src.audio_util import to_ms
+from src.metrics import metrics, timed
 from src.settings import TEMP_FILES_DIR
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(funcName)s - %(levelname)s - %(message)s')
@@ -16,12 +17,13 @@ logger = logging.getLogger(__name__)
 
 
 def download_audio(youtube_url: str, start_time=None, end_time=None, post_ext='mp3', yt_preferredquality=None,
-                   yt_format=None) -> tuple[str, dict]:
+                   yt_format=None, whisper_ready=False, ydl_cls=yt_dlp.YoutubeDL) -> tuple[str, dict]:
     """
     download audio from youtube link.
 
-    downloads the whole audio (trimming is done only after).
-    start_time, end_time: e.g. '00:00:30', '00:01:30'.
+    start_time, end_time: e.g. '00:00:30', '00:01:30'. only that section is downloaded.
+    whisper_ready: 16kHz mono wav (no lossy re-encoding, nothing left to resample).
+    ydl_cls: YoutubeDL compatible class (e.g. a local stand-in, no network).
 
     returns: filename, metadata
     """
@@ -34,37 +36,60 @@ def download_audio(youtube_url: str, start_time=None, end_time=None, post_ext='m
             youtube_url = f"https://www.youtube.com/watch?v={video_id}"
             logger.info(f"removed redundant query params")
 
-    yt_info_dict = yt_dlp.YoutubeDL().extract_info(youtube_url, download=False)
+    if whisper_ready:
+        post_ext = 'wav'
+
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'noplaylist': True,  # yt ignores playlist only for info, not for download
+    }
+    if yt_format:
+        ydl_opts['format'] = yt_format
+
+    # metadata, extracted once (reused for the download)
+    with timed('youtube_metadata'), ydl_cls(ydl_opts) as ydl:
+        yt_info_dict = ydl.extract_info(youtube_url, download=False)
+
     title = yt_info_dict.get('title', 'unknown_title')
     sanitized = re.sub(r'[^\w\s\-\(\)\[\]]', '_', title)
     res_filename_no_ext = f"{TEMP_FILES_DIR}/{sanitized}"
+
+    # section
+    if start_time or end_time:
+        start_sec = to_ms(start_time) / 1000 if start_time else 0
+        end_sec = to_ms(end_time) / 1000 if end_time else yt_info_dict.get('duration') or float('inf')
+        if end_sec <= start_sec:
+            raise ValueError(f"end_time <= start_time. start: {start_time}, end: {end_time}")
+
+        end_label = int(end_sec) if end_time else 'end'
+        res_filename_no_ext += f"_{int(start_sec)}-{end_label}"
+        ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [(start_sec, end_sec)])
+        ydl_opts['force_keyframes_at_cuts'] = True
+
     res_filename = f"{res_filename_no_ext}.{post_ext}"
 
     # file already exists
     if Path(res_filename).is_file():
         logger.info(f"file '{res_filename}' already exists")
+        metrics.inc('youtube_downloads_total', result='exists')
         return res_filename, get_info_from_result(yt_info_dict)[1]
 
     post_proc = [{
         'key': 'FFmpegExtractAudio',
         'preferredcodec': post_ext,
     }]
-
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'noplaylist': True,  # yt ignores playlist only for info, not for download
-        'postprocessors': post_proc,
-        'outtmpl': res_filename_no_ext,
-    }
-
-    if yt_format:
-        ydl_opts['format'] = yt_format
     if yt_preferredquality:  # e.g. '192'
         post_proc[0]['preferredquality'] = yt_preferredquality
 
-    logger.info(f"downloading audio from {youtube_url} ({title})...")
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        result = ydl.extract_info(youtube_url, download=True)
+    ydl_opts['postprocessors'] = post_proc
+    ydl_opts['outtmpl'] = res_filename_no_ext
+    if whisper_ready:
+        ydl_opts['postprocessor_args'] = {'extractaudio': ['-ar', '16000', '-ac', '1']}
+
+    logger.info(f"downloading audio from {youtube_url} ({title}) {start_time}-{end_time}...")
+    with timed('download'), ydl_cls(ydl_opts) as ydl:
+        result = ydl.process_ie_result(yt_info_dict, download=True)
+    metrics.inc('youtube_downloads_total', result='downloaded')
 
     set_date_to_now(res_filename)
 
@@ -72,12 +97,7 @@ def download_audio(youtube_url: str, start_time=None, end_time=None, post_ext='m
     file_path = Path(res_filename).resolve()
     logger.info(info_str)
     logger.info(f"file: '{file_path}', size: {file_path.stat().st_size / 1024 ** 2:.2f} MB")  # actually MiB
-
-    # trim
-    if start_time or end_time:
-        logger.info(f"trimming '{res_filename}' {start_time}-{end_time}...")
-        trimmed_filename = AudioEditor.audio_segment(res_filename, start_time, end_time, output_ext=post_ext)
-        return trimmed_filename, meta
+    metrics.inc('youtube_download_bytes_total', file_path.stat().st_size)
 
     return res_filename, meta
 
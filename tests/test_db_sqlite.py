@@ -0,0 +1,128 @@
+import pytest
+
+from src import db_sqlite
+from src.storage import VersionConflict
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_sqlite.init(str(tmp_path / 'transcripts.db'), str(tmp_path / 'blobs'))
+    return db_sqlite
+
+
+def save(db, title, content, segments=None):
+    return db.save_transcript({'title': title, 'content': content, 'src_type': 'file', 'channel': None}, segments)
+
+
+def test_fts_query_words_any():
+    assert db_sqlite.fts_query('alpha beta') == '"alpha" OR "beta"'
+
+
+def test_fts_query_phrase_keeps_words():
+    assert db_sqlite.fts_query('"exact phrase" other') == '"exact phrase" AND ("other")'
+
+
+def test_fts_query_prefix_and_excluded():
+    assert db_sqlite.fts_query('-gamma delt*') == '("delt"*) NOT "gamma"'
+
+
+def test_fts_query_quotes_input():
+    assert db_sqlite.fts_query('a"b OR') == '"a""b" OR "OR"'
+
+
+def test_fts_query_no_terms():
+    with pytest.raises(ValueError):
+        db_sqlite.fts_query(' - * ')
+
+
+def test_search_snippet_and_segments(db):
+    transcript_id = save(db, 'meeting', 'we talked about the budget and the roadmap',
+                         [{'start': 0, 'end': 2, 'text': 'we talked about'},
+                          {'start': 2, 'end': 5, 'text': 'the budget and the roadmap', 'speaker': 'A'}])
+    save(db, 'other', 'nothing to see here')
+
+    results, cursor = db.search_transcripts('budget')
+    assert cursor is None
+    assert [r['id'] for r in results] == [transcript_id]
+    assert '<mark>budget</mark>' in results[0]['snippet']
+    assert results[0]['segments'] == [{'start': 2, 'end': 5, 'text': 'the budget and the roadmap', 'speaker': 'A'}]
+
+
+def test_search_phrase_ranks_by_other_words(db):
+    save(db, 'a', 'the exact phrase is here')
+    with_word = save(db, 'b', 'the exact phrase is here with the other word, other again')
+
+    results, _ = db.search_transcripts('"exact phrase" other')
+    assert [r['id'] for r in results] == [with_word]
+    results, _ = db.search_transcripts('"exact phrase"')
+    assert len(results) == 2
+
+
+def test_search_cursor_paging(db):
+    ids = {save(db, f't{i}', f"shared word {'shared ' * i}") for i in range(7)}
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        results, cursor = db.search_transcripts('shared', limit=3, cursor=cursor)
+        seen += [r['id'] for r in results]
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 3
+    assert len(seen) == len(set(seen)) == 7
+    assert set(seen) == ids
+
+
+def test_get_segments_range(db):
+    transcript_id = save(db, 't', 'long then short', [{'start': 0, 'end': 600, 'text': 'long'},
+                                                      {'start': 600, 'end': 601, 'text': 'short'}])
+    assert [s['text'] for s in db.get_segments(transcript_id, 300, 320)] == ['long']
+    assert [s['text'] for s in db.get_segments(transcript_id, 599, 700)] == ['long', 'short']
+    assert db.get_segments(transcript_id, 700) == []
+
+
+def test_update_versioned(db):
+    transcript_id = save(db, 't', 'first text')
+    assert db.get_version(transcript_id) == 1
+
+    assert db.update_transcript(transcript_id, {'content': 'second text'}, version=1) == 2
+    with pytest.raises(VersionConflict):
+        db.update_transcript(transcript_id, {'content': 'stale write'}, version=1)
+    assert db.get_transcript(transcript_id)['content'] == 'second text'
+    assert db.update_transcript('12345', {'content': 'x'}) is None
+
+    results, _ = db.search_transcripts('second')
+    assert [r['id'] for r in results] == [transcript_id]
+    assert db.search_transcripts('first') == ([], None)
+
+
+def test_patch_versioned(db):
+    transcript_id = save(db, 't', 'hello wrld, bye')
+    assert db.patch_transcript(transcript_id, [{'start': 6, 'end': 10, 'text': 'world'},
+                                               {'start': 12, 'end': 15, 'text': 'goodbye'}], version=1) == 2
+    assert db.get_transcript(transcript_id)['content'] == 'hello world, goodbye'
+    with pytest.raises(VersionConflict):
+        db.patch_transcript(transcript_id, [{'start': 0, 'end': 0, 'text': '!'}], version=1)
+
+
+def test_update_offloaded_body(db, monkeypatch, tmp_path):
+    monkeypatch.setattr(db_sqlite, 'OFFLOAD_MIN_BYTES', 0)
+    transcript_id = save(db, 't', 'stored in a blob file')
+    assert len(list((tmp_path / 'blobs').iterdir())) == 1
+
+    db.update_transcript(transcript_id, {'content': 'replaced'})
+    assert db.get_transcript(transcript_id)['content'] == 'replaced'
+    assert len(list((tmp_path / 'blobs').iterdir())) == 1  # the old blob is deleted
+
+
+def test_bulk_dedup(db):
+    items = [{'title': f't{i}', 'content': f'text {i}', 'source_id': 'feed'} for i in range(3)]
+    first = db.save_transcripts(items)
+    assert [r['status'] for r in first] == ['inserted'] * 3
+
+    again = db.save_transcripts(items + [{'title': 'new', 'content': 'new text', 'source_id': 'feed'}])
+    assert [r['status'] for r in again] == ['exists'] * 3 + ['inserted']
+    assert [r['id'] for r in again[:3]] == [r['id'] for r in first]
+
+    other_source = db.save_transcripts([dict(items[0], source_id='other')])
+    assert other_source[0]['status'] == 'inserted'
@@ -0,0 +1,43 @@
+import numpy as np
+
+from src.vad import dedup_overlap, find_pause, split_at_pauses
+
+SR = 16000
+
+
+def test_dedup_overlap_drops_repeated_words():
+    assert dedup_overlap("so we went to the store", "the store was closed") == "was closed"
+
+
+def test_dedup_overlap_ignores_case_and_punctuation():
+    assert dedup_overlap("We went to the Store.", "the store, was closed") == "was closed"
+
+
+def test_dedup_overlap_keeps_single_word_match():
+    assert dedup_overlap("I", "I think") == "I think"
+    assert dedup_overlap("and then I", "I think so") == "I think so"
+
+
+def test_dedup_overlap_no_match():
+    assert dedup_overlap("hello there", "general kenobi") == "general kenobi"
+
+
+def speech_with_pause(before_sec, pause_sec, after_sec) -> np.ndarray:
+    t = np.arange(int((before_sec + pause_sec + after_sec) * SR)) / SR
+    audio = 0.3 * np.sin(2 * np.pi * 200 * t)
+    audio[int(before_sec * SR):int((before_sec + pause_sec) * SR)] = 0
+    return audio.astype(np.float32)
+
+
+def test_find_pause():
+    cut = find_pause(speech_with_pause(2, 1, 2), SR)
+    assert 2 * SR < cut < 3 * SR
+    assert find_pause(speech_with_pause(2, 1, 2), SR, min_pos=4 * SR) is None
+
+
+def test_split_at_pauses_covers_audio():
+    audio = speech_with_pause(3, 1, 6)
+    bounds = split_at_pauses(audio, SR, window_sec=5)
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(audio)
+    assert all(end == start for (_, end), (start, _) in zip(bounds, bounds[1:]))
+    assert all(end - start <= 5 * SR for start, end in bounds)